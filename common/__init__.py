@@ -0,0 +1,4 @@
+"""
+Shared building blocks used by the scripts in data_acquisition, data_provision,
+modeling and development.
+"""
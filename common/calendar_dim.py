@@ -0,0 +1,103 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import holidays
+
+from common.data_access import table_exists
+
+# Labels written at ingest time and the integer codes the models are trained on.
+SPECIAL_DAY_CODES = {
+    "Weekday": 0,
+    "Saturday": 1,
+    "Sunday": 2,
+    "Public Holiday": 3,
+}
+
+CALENDAR_TABLE = "calendar_dim"
+
+
+def build_calendar(dates, country: str = "US") -> pd.DataFrame:
+    """
+    Label every distinct date in dates once.
+    Returns a DataFrame indexed by the normalized date with the columns
+    special_day (label) and special_day_code (0-3).
+    """
+    days = pd.DatetimeIndex(pd.to_datetime(dates)).normalize().dropna().unique().sort_values()
+    holiday_cal = holidays.country_holidays(country, years=sorted(set(days.year)))
+    is_holiday = days.isin(pd.to_datetime(list(holiday_cal.keys())))
+    weekday = days.weekday
+
+    labels = np.select(
+        [is_holiday, weekday == 5, weekday == 6],
+        ["Public Holiday", "Saturday", "Sunday"],
+        default="Weekday",
+    )
+    calendar = pd.DataFrame({"special_day": labels}, index=days)
+    calendar["special_day_code"] = calendar["special_day"].map(SPECIAL_DAY_CODES)
+    calendar.index.name = "date"
+    return calendar
+
+
+class CalendarDimension:
+    """
+    Calendar table for one holiday country that grows on demand.
+    Each date is labelled once; label() broadcasts the result back to any
+    number of timestamps with a factorize/take instead of a row-wise apply.
+    """
+
+    def __init__(self, country: str = "US", calendar: pd.DataFrame = None):
+        self.country = country
+        self.calendar = calendar if calendar is not None else build_calendar([], country)
+
+    def label(self, datetimes: pd.Series, column: str = "special_day") -> pd.Series:
+        """Return column (special_day or special_day_code) for every timestamp."""
+        codes, days = pd.factorize(pd.to_datetime(datetimes).dt.normalize())
+        missing = days.difference(self.calendar.index)
+        if len(missing):
+            self.merge(build_calendar(missing, self.country))
+
+        values = self.calendar[column].reindex(days).to_numpy()
+        result = pd.Series(values[codes], index=datetimes.index, name=column)
+        if (codes < 0).any():
+            result[codes < 0] = None
+        return result
+
+    def merge(self, calendar: pd.DataFrame):
+        """Add dates labelled elsewhere (e.g. in a worker process) to this calendar."""
+        new_days = calendar.index.difference(self.calendar.index)
+        if len(new_days):
+            self.calendar = pd.concat([self.calendar, calendar.loc[new_days]]).sort_index()
+
+    def to_sql(self, conn: sqlite3.Connection):
+        """Upsert the dates known so far into the shared calendar_dim table."""
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CALENDAR_TABLE} (
+                date              TEXT,
+                country           TEXT,
+                special_day       TEXT,
+                special_day_code  INTEGER,
+                PRIMARY KEY (date, country)
+            )
+        """)
+        rows = zip(
+            self.calendar.index.strftime("%Y-%m-%d"),
+            [self.country] * len(self.calendar),
+            self.calendar["special_day"],
+            self.calendar["special_day_code"].astype(int).tolist(),
+        )
+        conn.executemany(f"INSERT OR REPLACE INTO {CALENDAR_TABLE} VALUES (?, ?, ?, ?)", rows)
+
+    @classmethod
+    def from_sql(cls, conn: sqlite3.Connection, country: str = "US") -> "CalendarDimension":
+        """Load the precomputed dates for country, or start empty if none exist yet."""
+        if not table_exists(conn, CALENDAR_TABLE):
+            return cls(country)
+
+        calendar = pd.read_sql_query(
+            f"SELECT date, special_day, special_day_code FROM {CALENDAR_TABLE} WHERE country = ?",
+            conn, params=(country,), parse_dates=["date"], index_col="date",
+        )
+        if calendar.empty:
+            return cls(country)
+        return cls(country, calendar.sort_index())
@@ -0,0 +1,270 @@
+import json
+import re
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+from sklearn.cluster import KMeans, MiniBatchKMeans
+
+from common.data_access import PROJECT_ROOT
+from common.db_maintenance import bulk_update
+
+# ─── Config ─────────────────────────────────────────────────────────────
+N_CLUSTERS = 10
+RANDOM_STATE = 42
+CHUNK_SIZE = 500_000    # rows read from SQLite per chunk
+BATCH_SIZE = 4096       # points per mini-batch step
+EPOCHS = 2              # passes over the table while fitting (rows arrive ordered by month)
+
+GRID_DEG = 0.001        # cell edge for grid pre-aggregation (~110 m of latitude)
+# rows with a usable position (as in the outlier stages); others stay unlabelled (NULL cluster)
+VALID_COORDS = "typeof(Lat) IN ('real', 'integer') AND typeof(Lon) IN ('real', 'integer')"
+
+# Fitted centroids are kept as versioned JSON artifacts centroids_v001.json, ...
+MODEL_DIR = PROJECT_ROOT / "data_provision" / "cluster_models"
+
+
+def coordinate_chunks(conn: sqlite3.Connection, table: str, chunk_size: int = CHUNK_SIZE, where: str = ""):
+    """Yield (rowid, Lat, Lon) frames of the valid rows of table (optionally filtered), chunk_size rows at a time."""
+    query = f"SELECT rowid, Lat, Lon FROM {table} WHERE {VALID_COORDS}" + (f" AND ({where})" if where else "")
+    yield from pd.read_sql_query(query, conn, chunksize=chunk_size)
+
+
+def nearest_centroid(coords: np.ndarray, centers: np.ndarray):
+    """Vectorized nearest-centroid labels (0-based) and squared distances for an (n, 2) array."""
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 ; |x|^2 does not change the argmin
+    d2 = (centers ** 2).sum(axis=1) - 2 * coords @ centers.T
+    labels = d2.argmin(axis=1)
+    sq_dist = np.maximum(d2[np.arange(len(coords)), labels] + (coords ** 2).sum(axis=1), 0)
+    return labels, sq_dist
+
+
+def init_params(init: np.ndarray = None) -> dict:
+    """KMeans keyword arguments to start from the given centres (warm start) instead of k-means++."""
+    return {} if init is None else {"init": np.asarray(init, dtype=float), "n_init": 1}
+
+
+def match_clusters(centers: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """
+    Order of centers that best matches reference row by row (minimum total
+    squared distance, Hungarian algorithm): centers[order][i] takes over the
+    ID of reference[i].
+    """
+    cost = ((reference[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+    rows, cols = linear_sum_assignment(cost)
+    return cols[np.argsort(rows)]
+
+
+def centroid_shift_m(centers: np.ndarray, reference: np.ndarray) -> np.ndarray:
+    """Approximate distance in metres between matching rows of two (Lat, Lon) centre arrays."""
+    dlat = (centers[:, 0] - reference[:, 0]) * 111_320
+    dlon = (centers[:, 1] - reference[:, 1]) * 111_320 * np.cos(np.radians(reference[:, 0]))
+    return np.hypot(dlat, dlon)
+
+
+def fit_minibatch(conn: sqlite3.Connection, table: str, n_clusters: int = N_CLUSTERS,
+                  epochs: int = EPOCHS, chunk_size: int = CHUNK_SIZE, batch_size: int = BATCH_SIZE,
+                  random_state: int = RANDOM_STATE, init: np.ndarray = None) -> MiniBatchKMeans:
+    """
+    Fit MiniBatchKMeans on the Lat/Lon of table without loading it: each chunk
+    is shuffled and fed to partial_fit in batch_size steps. Memory is bounded
+    by chunk_size regardless of the table size. init warm-starts from given centres.
+    """
+    km = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size,
+                         random_state=random_state, compute_labels=False, **init_params(init))
+    rng = np.random.default_rng(random_state)
+    for _ in range(epochs):
+        for chunk in coordinate_chunks(conn, table, chunk_size):
+            coords = chunk[["Lat", "Lon"]].to_numpy(float)[rng.permutation(len(chunk))]
+            for i in range(0, len(coords), batch_size):
+                batch = coords[i:i + batch_size]
+                if len(batch) >= n_clusters:
+                    km.partial_fit(batch)
+    return km
+
+
+def label_table(conn: sqlite3.Connection, table: str, centers: np.ndarray,
+                column: str = "cluster", chunk_size: int = CHUNK_SIZE, where: str = ""):
+    """
+    Assign every row of table with a valid position (and matching where) to its
+    nearest centre (labels 1..k). The rows are read in rowid order, chunk_size at a time, and each
+    chunk's labels are written with one set-based UPDATE before the next is read,
+    so only one chunk of labels is staged (the temp table lives in RAM).
+    Returns the per-cluster count/mean Lat/mean Lon of the assigned rows and the
+    inertia (sum of squared distances to the centres).
+    """
+    k = len(centers)
+    counts, lat_sum, lon_sum = np.zeros(k), np.zeros(k), np.zeros(k)
+    inertia = 0.0
+    # keyset paging instead of one open cursor: the table is updated between reads
+    query = (f"SELECT rowid, Lat, Lon FROM {table} WHERE rowid > ? AND {VALID_COORDS}"
+             + (f" AND ({where})" if where else "") + " ORDER BY rowid LIMIT ?")
+    last = 0
+    while True:
+        chunk = pd.read_sql_query(query, conn, params=(last, chunk_size))
+        if chunk.empty:
+            break
+        coords = chunk[["Lat", "Lon"]].to_numpy(float)
+        labels, sq_dist = nearest_centroid(coords, centers)
+        bulk_update(conn, table, column, chunk["rowid"].to_numpy(), labels + 1)
+        counts += np.bincount(labels, minlength=k)
+        lat_sum += np.bincount(labels, weights=coords[:, 0], minlength=k)
+        lon_sum += np.bincount(labels, weights=coords[:, 1], minlength=k)
+        inertia += sq_dist.sum()
+        last = int(chunk["rowid"].iloc[-1])
+
+    occupied = counts > 0
+    centroids = pd.DataFrame({
+        "cluster": np.arange(1, k + 1)[occupied],
+        "Lat": lat_sum[occupied] / counts[occupied],
+        "Lon": lon_sum[occupied] / counts[occupied],
+        "count": counts[occupied].astype(int),
+    })
+    return centroids, inertia
+
+
+# ─── Grid pre-aggregation ───────────────────────────────────────────────
+# Trips are binned in SQL onto cells of grid_deg degrees; KMeans then sees one
+# weighted point (the cell's mean position, weight = trips) per occupied cell,
+# so its cost depends on the number of cells rather than trips.
+
+def _cell_key(column: str, grid_deg: float) -> str:
+    return f"CAST(ROUND({column} / {float(grid_deg)!r}) AS INTEGER)"
+
+
+def grid_cells(conn: sqlite3.Connection, table: str, grid_deg: float = GRID_DEG, where: str = "") -> pd.DataFrame:
+    """Occupied cells of the valid rows of table: key (gy, gx), trip count n, mean Lat/Lon and sums of squares."""
+    return pd.read_sql_query(f"""
+        SELECT {_cell_key("Lat", grid_deg)} AS gy, {_cell_key("Lon", grid_deg)} AS gx,
+               COUNT(*) AS n, AVG(Lat) AS Lat, AVG(Lon) AS Lon,
+               SUM(Lat * Lat) AS lat_sq, SUM(Lon * Lon) AS lon_sq
+        FROM {table}
+        WHERE {VALID_COORDS}{f" AND ({where})" if where else ""}
+        GROUP BY gy, gx
+    """, conn)
+
+
+def fit_grid(conn: sqlite3.Connection, table: str, n_clusters: int = N_CLUSTERS,
+             grid_deg: float = GRID_DEG, random_state: int = RANDOM_STATE, init: np.ndarray = None) -> KMeans:
+    """Full-batch KMeans on the occupied grid cells of table, weighted by their trip counts."""
+    cells = grid_cells(conn, table, grid_deg)
+    return KMeans(n_clusters=n_clusters, random_state=random_state, **init_params(init)).fit(
+        cells[["Lat", "Lon"]].to_numpy(float), sample_weight=cells["n"].to_numpy(float)
+    )
+
+
+def label_table_by_grid(conn: sqlite3.Connection, table: str, centers: np.ndarray, column: str = "cluster",
+                        grid_deg: float = GRID_DEG, where: str = ""):
+    """
+    Like label_table(), but labels each occupied cell by its mean position and
+    maps the cell labels back to the trips with one UPDATE ... FROM join on the
+    cell key. Counts, means and inertia are still exact per trip (the inertia
+    adds each cell's spread around its mean).
+    """
+    k = len(centers)
+    cells = grid_cells(conn, table, grid_deg, where)
+    coords = cells[["Lat", "Lon"]].to_numpy(float)
+    n = cells["n"].to_numpy(float)
+    labels, sq_dist = nearest_centroid(coords, centers)
+
+    conn.execute("DROP TABLE IF EXISTS temp.grid_labels")
+    conn.execute("CREATE TEMP TABLE grid_labels (gy INTEGER, gx INTEGER, label INTEGER, "
+                 "PRIMARY KEY (gy, gx)) WITHOUT ROWID")
+    conn.executemany("INSERT INTO temp.grid_labels VALUES (?, ?, ?)",
+                     zip(cells["gy"].tolist(), cells["gx"].tolist(), (labels + 1).tolist()))
+    conn.execute(f"""
+        UPDATE {table} SET [{column}] = g.label
+        FROM temp.grid_labels AS g
+        WHERE g.gy = {_cell_key(f"{table}.Lat", grid_deg)} AND g.gx = {_cell_key(f"{table}.Lon", grid_deg)}
+        AND {VALID_COORDS}{f" AND ({where})" if where else ""}
+    """)
+    conn.execute("DROP TABLE temp.grid_labels")
+
+    spread = cells["lat_sq"].to_numpy(float) + cells["lon_sq"].to_numpy(float) - n * (coords ** 2).sum(axis=1)
+    inertia = float((n * sq_dist).sum() + np.maximum(spread, 0).sum())
+    counts = np.bincount(labels, weights=n, minlength=k)
+    lat_sum = np.bincount(labels, weights=n * coords[:, 0], minlength=k)
+    lon_sum = np.bincount(labels, weights=n * coords[:, 1], minlength=k)
+
+    occupied = counts > 0
+    centroids = pd.DataFrame({
+        "cluster": np.arange(1, k + 1)[occupied],
+        "Lat": lat_sum[occupied] / counts[occupied],
+        "Lon": lon_sum[occupied] / counts[occupied],
+        "count": counts[occupied].astype(int),
+    })
+    return centroids, inertia
+
+
+# ─── Persisted centroid model ───────────────────────────────────────────
+
+class CentroidModel:
+    """
+    Fitted cluster centres (row i is cluster i + 1) plus fit metadata, saved as
+    a versioned artifact. New trips are labelled by nearest centroid, so no
+    re-fit is needed to cluster another month of data.
+    """
+
+    def __init__(self, centers, meta: dict = None):
+        self.centers = np.asarray(centers, dtype=float)
+        self.meta = dict(meta or {})
+
+    @property
+    def n_clusters(self) -> int:
+        return len(self.centers)
+
+    @property
+    def version(self):
+        return self.meta.get("version")
+
+    def assign(self, lat, lon, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+        """Cluster labels (1..k) for arbitrary batches of coordinates."""
+        coords = np.column_stack([np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)])
+        labels = np.empty(len(coords), dtype=np.int64)
+        for i in range(0, len(coords), chunk_size):
+            labels[i:i + chunk_size] = nearest_centroid(coords[i:i + chunk_size], self.centers)[0] + 1
+        return labels
+
+    def label_table(self, conn: sqlite3.Connection, table: str, column: str = "cluster",
+                    chunk_size: int = CHUNK_SIZE, where: str = "", grid_deg: float = None):
+        """
+        Write the labels into column of table, per trip (label_table()) or, with
+        grid_deg, per grid cell mapped back by join (label_table_by_grid()).
+        """
+        if grid_deg:
+            return label_table_by_grid(conn, table, self.centers, column, grid_deg, where)
+        return label_table(conn, table, self.centers, column, chunk_size, where)
+
+    def save(self, model_dir: Path = MODEL_DIR) -> Path:
+        """Write the model as the next version in model_dir and return its path."""
+        model_dir = Path(model_dir)
+        model_dir.mkdir(parents=True, exist_ok=True)
+        self.meta["version"] = max(model_versions(model_dir), default=0) + 1
+        self.meta.setdefault("created", datetime.now().isoformat(timespec="seconds"))
+        path = model_dir / f"centroids_v{self.version:03d}.json"
+        path.write_text(json.dumps({**self.meta, "centers": self.centers.tolist()}, indent=2))
+        return path
+
+    @classmethod
+    def load(cls, version: int = None, model_dir: Path = MODEL_DIR) -> "CentroidModel":
+        """Load the given version, or the latest one if version is None."""
+        versions = model_versions(model_dir)
+        if not versions:
+            raise FileNotFoundError(f"No centroid model found in {model_dir}")
+        version = version or max(versions)
+        if version not in versions:
+            raise FileNotFoundError(f"Centroid model version {version} not found in {model_dir}")
+        data = json.loads((Path(model_dir) / f"centroids_v{version:03d}.json").read_text())
+        return cls(data.pop("centers"), data)
+
+
+def model_versions(model_dir: Path = MODEL_DIR) -> list:
+    """Versions of the centroid artifacts stored in model_dir."""
+    model_dir = Path(model_dir)
+    if not model_dir.is_dir():
+        return []
+    return sorted(int(m.group(1)) for p in model_dir.glob("centroids_v*.json")
+                  if (m := re.fullmatch(r"centroids_v(\d+)\.json", p.name)))
@@ -0,0 +1,216 @@
+import re
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.calendar_dim import SPECIAL_DAY_CODES
+from common.data_access import table_columns
+
+# ─── Compact trip schema (version 2) ────────────────────────────────────
+# ts             INTEGER  epoch seconds of the (naive, local) Date/Time
+# day/hour/weekday        pre-extracted calendar fields
+# special_day    INTEGER  0 = Weekday, 1 = Saturday, 2 = Sunday, 3 = Public Holiday
+# base_id / source_file_id  keys into the dim_base / dim_source_file dictionaries
+COMPACT_SUFFIX = "_compact"
+MIGRATION_CHUNK_SIZE = 500_000
+
+DICTIONARY_COLUMNS = {
+    "Base": ("dim_base", "base_id"),
+    "source_file": ("dim_source_file", "source_file_id"),
+}
+
+# derived or superseded columns of the text schema that are not carried over
+DROPPED_COLUMNS = {"Date/Time", "parsed_datetime", "month", "special_day", "Base", "source_file"}
+# text-schema columns that read_compact rebuilds from ts
+DERIVED_COLUMNS = ("parsed_datetime", "month")
+SPECIAL_DAY_LABELS = {code: label for label, code in SPECIAL_DAY_CODES.items()}
+
+
+def compact_name(table: str) -> str:
+    return f"{table}{COMPACT_SUFFIX}"
+
+
+def table_bytes(conn: sqlite3.Connection, table: str):
+    """On-disk size of table in bytes, or None if SQLite was built without dbstat."""
+    try:
+        return conn.execute("SELECT SUM(pgsize) FROM dbstat WHERE name = ?", (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return None
+
+
+# ─── Dictionary coding ──────────────────────────────────────────────────
+
+def ensure_dictionaries(conn: sqlite3.Connection):
+    for dim_table, _ in DICTIONARY_COLUMNS.values():
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {dim_table} (
+                id     INTEGER PRIMARY KEY,
+                value  TEXT UNIQUE
+            )
+        """)
+
+
+def encode_values(conn: sqlite3.Connection, column: str, values: pd.Series) -> np.ndarray:
+    """Map the strings in values to their dictionary ids, adding unseen ones."""
+    dim_table, _ = DICTIONARY_COLUMNS[column]
+    uniques = values.dropna().unique()
+    conn.executemany(f"INSERT OR IGNORE INTO {dim_table} (value) VALUES (?)", ((str(v),) for v in uniques))
+    placeholders = ", ".join("?" * len(uniques))
+    mapping = dict(conn.execute(
+        f"SELECT value, id FROM {dim_table} WHERE value IN ({placeholders})", [str(v) for v in uniques]
+    ).fetchall())
+    return values.map(mapping).to_numpy()
+
+
+def decode_values(conn: sqlite3.Connection, column: str, ids: pd.Series) -> pd.Series:
+    dim_table, _ = DICTIONARY_COLUMNS[column]
+    mapping = dict(conn.execute(f"SELECT id, value FROM {dim_table}").fetchall())
+    return ids.map(mapping)
+
+
+# ─── Text schema -> compact schema ──────────────────────────────────────
+
+def compact_frame(conn: sqlite3.Connection, df: pd.DataFrame) -> pd.DataFrame:
+    """Convert a chunk of a text-schema trip table to the compact column layout."""
+    parsed = pd.to_datetime(df["Date/Time"])
+    out = pd.DataFrame({
+        "ts": parsed.to_numpy().astype("datetime64[s]").astype("int64"),
+        "Lat": df["Lat"].to_numpy(),
+        "Lon": df["Lon"].to_numpy(),
+    })
+    for column, (_, id_column) in DICTIONARY_COLUMNS.items():
+        if column in df.columns:
+            out[id_column] = encode_values(conn, column, df[column])
+    out["day"] = parsed.dt.day.to_numpy()
+    out["hour"] = parsed.dt.hour.to_numpy()
+    out["weekday"] = parsed.dt.weekday.to_numpy()
+    if "special_day" in df.columns:
+        out["special_day"] = df["special_day"].map(SPECIAL_DAY_CODES).to_numpy()
+    for column in df.columns:
+        if column not in DROPPED_COLUMNS and column not in out.columns:
+            out[column] = df[column].to_numpy()
+    return out
+
+
+def create_compact_table(conn: sqlite3.Connection, table: str, source_columns) -> list:
+    """(Re)create the compact counterpart of table; returns its column list."""
+    columns = [("ts", "INTEGER"), ("Lat", "REAL"), ("Lon", "REAL")]
+    for column, (_, id_column) in DICTIONARY_COLUMNS.items():
+        if column in source_columns:
+            columns.append((id_column, "INTEGER"))
+    columns += [("day", "INTEGER"), ("hour", "INTEGER"), ("weekday", "INTEGER")]
+    if "special_day" in source_columns:
+        columns.append(("special_day", "INTEGER"))
+    for column in source_columns:
+        if column not in DROPPED_COLUMNS and column not in ("Lat", "Lon"):
+            columns.append((column, "INTEGER" if column in ("cluster", "sample_bucket") else "TEXT"))
+
+    target = compact_name(table)
+    conn.execute(f"DROP TABLE IF EXISTS {target}")
+    conn.execute(f"CREATE TABLE {target} ({', '.join(f'[{n}] {t}' for n, t in columns)})")
+    return [n for n, _ in columns]
+
+
+def migrate_view(conn: sqlite3.Connection, view: str) -> str:
+    """
+    (Re)create <view>_compact as the same query over the compact counterparts of
+    the tables view reads (e.g. the hash-sampled training sets), so it stays a
+    view instead of a copy. Tables without a compact counterpart are kept as they are.
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'view' AND name = ?", (view,)).fetchone()[0]
+    query = re.split(r"\bAS\b", sql, maxsplit=1, flags=re.IGNORECASE)[1]
+    compact_tables = {r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (f"%{COMPACT_SUFFIX}",))}
+    for table in compact_tables:
+        source = table[:-len(COMPACT_SUFFIX)]
+        query = re.sub(rf"\b{re.escape(source)}\b", table, query)
+
+    target = compact_name(view)
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (target,)).fetchone()
+    if kind:  # may still be a table copied from an earlier physical training set
+        conn.execute(f"DROP {kind[0].upper()} {target}")
+    conn.execute(f"CREATE VIEW {target} AS {query.strip()}")
+    conn.commit()
+    print(f"▶ View '{target}' = '{view}' over the compact tables")
+    return target
+
+
+def migrate_table(conn: sqlite3.Connection, table: str, chunk_size: int = MIGRATION_CHUNK_SIZE) -> str:
+    """
+    Copy a text-schema trip table into its compact counterpart <table>_compact,
+    streaming chunk_size rows at a time. The source table is left untouched.
+    Views are recreated over the compact tables instead (migrate_view()).
+    """
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (table,)).fetchone()
+    if kind and kind[0] == "view":
+        return migrate_view(conn, table)
+    start = time.perf_counter()
+    source_columns = table_columns(conn, table)
+    ensure_dictionaries(conn)
+    columns = create_compact_table(conn, table, source_columns)
+    target = compact_name(table)
+    insert_sql = (f"INSERT INTO {target} ({', '.join(f'[{c}]' for c in columns)}) "
+                  f"VALUES ({', '.join('?' * len(columns))})")
+
+    rows = 0
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    for chunk in pd.read_sql_query(f"SELECT * FROM {table}", conn, chunksize=chunk_size):
+        out = compact_frame(conn, chunk)[columns]
+        conn.executemany(insert_sql, out.astype(object).where(out.notna(), None).itertuples(index=False, name=None))
+        rows += len(out)
+    conn.commit()
+
+    before, after = table_bytes(conn, table), table_bytes(conn, target)
+    size_info = f", {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB" if before and after else ""
+    print(f"▶ Migrated {rows} rows '{table}' -> '{target}' in {time.perf_counter() - start:.1f}s{size_info}")
+    return target
+
+
+# ─── Compact schema -> frames ───────────────────────────────────────────
+
+def read_compact(conn: sqlite3.Connection, table: str, columns=None, where: str = "", params=()) -> pd.DataFrame:
+    """
+    Read <table>_compact, optionally filtered by a SQL where clause.
+    Columns come back as in the text schema so callers keep working unchanged:
+    Date/Time, Base and source_file are decoded, special_day is mapped back to its
+    label and month/parsed_datetime are rebuilt from ts (by default only if the
+    text table has them). The compact-only columns (ts, day, hour, weekday, ...)
+    are returned as stored.
+    """
+    target = compact_name(table)
+    stored = table_columns(conn, target)
+    id_columns = {id_column: column for column, (_, id_column) in DICTIONARY_COLUMNS.items()}
+    if columns:
+        wanted = list(columns)
+    else:
+        source_columns = table_columns(conn, table)
+        wanted = (["Date/Time"] + [id_columns.get(c, c) for c in stored if c != "ts"]
+                  + [c for c in DERIVED_COLUMNS if c in source_columns])
+
+    select = set()
+    for column in wanted:
+        if column == "Date/Time" or column in DERIVED_COLUMNS:
+            select.add("ts")
+        elif column in DICTIONARY_COLUMNS:
+            select.add(DICTIONARY_COLUMNS[column][1])
+        else:
+            select.add(column)
+    query = f"SELECT {', '.join(f'[{c}]' for c in select)} FROM {target}"
+    raw = pd.read_sql_query(f"{query} WHERE {where}" if where else query, conn, params=list(params))
+
+    df = pd.DataFrame(index=raw.index)
+    for column in wanted:
+        if column in ("Date/Time", "parsed_datetime"):
+            df[column] = pd.to_datetime(raw["ts"], unit="s")
+        elif column == "month":
+            df[column] = pd.to_datetime(raw["ts"], unit="s").dt.strftime("%Y-%m")
+        elif column in DICTIONARY_COLUMNS:
+            df[column] = decode_values(conn, column, raw[DICTIONARY_COLUMNS[column][1]])
+        elif column == "special_day":
+            df[column] = raw[column].map(SPECIAL_DAY_LABELS)
+        else:
+            df[column] = raw[column]
+    return df
@@ -0,0 +1,100 @@
+import os
+import sqlite3
+from contextlib import closing
+from functools import lru_cache
+from pathlib import Path
+
+# ─── Config ─────────────────────────────────────────────────────────────
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+DB_NAME = "data_consolidated.db"
+DEFAULT_DB_PATH = PROJECT_ROOT / "data_acquisition" / "data_ingest" / DB_NAME
+
+# TRANSPORT_DB_PATH pins the database explicitly; otherwise the default location is
+# used, then the path remembered in DB_PATH_CACHE, then a one-off search of the tree.
+DB_PATH_ENV = "TRANSPORT_DB_PATH"
+DB_PATH_CACHE = PROJECT_ROOT / ".db_path_cache"
+SEARCH_SKIP_DIRS = {".git", "mlruns", "mlartifacts", "parquet", "venv", ".venv", "__pycache__", ".idea"}
+
+# Applied to every connection handed out by connect().
+CONNECTION_PRAGMAS = {
+    "busy_timeout": 30000,
+    "temp_store": "MEMORY",
+    "cache_size": -65536,     # 64 MB
+    "mmap_size": 268435456,   # 256 MB
+}
+
+
+def list_tables(conn: sqlite3.Connection) -> set:
+    return {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+
+
+def table_exists(conn: sqlite3.Connection, table: str) -> bool:
+    """True for tables and views (the hash-sampled training sets are views)."""
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name=?", (table,)
+    ).fetchone() is not None
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list:
+    return [r[1] for r in conn.execute(f"PRAGMA table_info({table});")]
+
+
+def _has_table(path: Path, table: str = None) -> bool:
+    """True if path is a readable SQLite file (containing table, if given)."""
+    if not path.is_file():
+        return False
+    try:
+        with closing(sqlite3.connect(f"{path.resolve().as_uri()}?mode=ro", uri=True)) as conn:
+            conn.execute("SELECT name FROM sqlite_master LIMIT 1;")
+            return table_exists(conn, table) if table else True
+    except sqlite3.DatabaseError:
+        return False
+
+
+def _search_tree(table: str = None):
+    """Walk the project tree (skipping mlruns, data exports, ...) for DB_NAME."""
+    for root, dirs, files in os.walk(PROJECT_ROOT):
+        dirs[:] = [d for d in dirs if d not in SEARCH_SKIP_DIRS]
+        if DB_NAME in files:
+            candidate = Path(root) / DB_NAME
+            if _has_table(candidate, table):
+                return candidate
+    return None
+
+
+@lru_cache(maxsize=None)
+def resolve_db_path(required_table: str = None, must_exist: bool = True) -> Path:
+    """
+    Locate data_consolidated.db (optionally one containing required_table).
+    With must_exist=False (writers such as the ingest) the configured or default
+    path is returned even if the file does not exist yet.
+    """
+    if os.environ.get(DB_PATH_ENV):
+        path = Path(os.environ[DB_PATH_ENV]).expanduser()
+        if not must_exist or _has_table(path, required_table):
+            return path
+        raise FileNotFoundError(f"{DB_PATH_ENV}={path} does not contain table '{required_table}'")
+
+    if not must_exist or _has_table(DEFAULT_DB_PATH, required_table):
+        return DEFAULT_DB_PATH
+
+    if DB_PATH_CACHE.is_file():
+        cached = Path(DB_PATH_CACHE.read_text().strip())
+        if _has_table(cached, required_table):
+            return cached
+
+    found = _search_tree(required_table)
+    if found is None:
+        target = f" containing table '{required_table}'" if required_table else ""
+        raise FileNotFoundError(f"No '{DB_NAME}'{target} found under {PROJECT_ROOT}")
+    DB_PATH_CACHE.write_text(str(found))
+    return found
+
+
+def connect(db_path: Path = None, required_table: str = None, **kwargs) -> sqlite3.Connection:
+    """Open the project database with the shared CONNECTION_PRAGMAS applied."""
+    path = db_path or resolve_db_path(required_table)
+    conn = sqlite3.connect(path, **kwargs)
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+    return conn
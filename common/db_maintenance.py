@@ -0,0 +1,154 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from common.data_access import list_tables, table_columns
+
+# ─── Declared indexes ───────────────────────────────────────────────────
+# Every trip table gets one index per column below that it actually has:
+# cluster for the per-cluster GROUP BYs, the timestamp for range/month scans,
+# source_file for incremental re-ingest deletes and sample_bucket for the hash
+# sample views (a 10% sample is a range scan of the index).
+INDEXED_COLUMNS = ["cluster", "Date/Time", "ts", "source_file", "source_file_id", "sample_bucket"]
+
+TRIP_TABLES = [
+    "taxi_input_model_unrestricted",
+    "taxi_input_model_iqr",
+    "taxi_input_model_dbscan",
+    "training_set_10_random_blue",
+    "training_set_5_random_blue",
+]
+
+# Pragmas used while bulk loading; the previous values are restored afterwards.
+BULK_LOAD_PRAGMAS = {
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+    "temp_store": "MEMORY",
+    "cache_size": -262144,  # 256 MB
+}
+
+
+def index_name(table: str, column: str) -> str:
+    return f"idx_{table}_{column.replace('/', '_').lower()}"
+
+
+def declared_indexes(conn: sqlite3.Connection, table: str) -> list:
+    """(index name, column) pairs declared for table, limited to columns it has."""
+    columns = set(table_columns(conn, table))
+    return [(index_name(table, c), c) for c in INDEXED_COLUMNS if c in columns]
+
+
+def ensure_indexes(conn: sqlite3.Connection, tables=None, analyze: bool = True) -> float:
+    """
+    Create the declared indexes on tables (default: all trip tables and their
+    compact counterparts that exist) and refresh the planner statistics.
+    Returns the elapsed time in seconds.
+    """
+    start = time.perf_counter()
+    present = list_tables(conn)
+    if tables is None:
+        tables = [t for base in TRIP_TABLES for t in (base, f"{base}_compact")]
+
+    for table in tables:
+        if table not in present:
+            continue
+        for name, column in declared_indexes(conn, table):
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ([{column}])")
+        if analyze:
+            conn.execute(f"ANALYZE {table}")
+    conn.commit()
+
+    elapsed = time.perf_counter() - start
+    print(f"▶ Indexes ensured and analyzed on {', '.join(t for t in tables if t in present)} in {elapsed:.1f}s")
+    return elapsed
+
+
+def drop_indexes(conn: sqlite3.Connection, table: str):
+    """Drop every secondary index of table (automatic PRIMARY KEY/UNIQUE indexes stay)."""
+    names = [r[0] for r in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type='index' AND tbl_name=? AND sql IS NOT NULL", (table,)
+    )]
+    for name in names:
+        conn.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+@contextmanager
+def bulk_load(conn: sqlite3.Connection, tables, drop_existing_indexes: bool = True):
+    """
+    Relax journaling/sync for a large write and, unless told otherwise, drop the
+    secondary indexes of tables first. On exit the pragmas are restored and the
+    declared indexes are rebuilt and analyzed. An open transaction is committed
+    first because journal_mode cannot change inside one.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    previous = {p: conn.execute(f"PRAGMA {p}").fetchone()[0] for p in BULK_LOAD_PRAGMAS}
+    for pragma, value in BULK_LOAD_PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {value}")
+
+    present = list_tables(conn)
+    if drop_existing_indexes:
+        for table in tables:
+            if table in present:
+                drop_indexes(conn, table)
+        conn.commit()
+
+    start = time.perf_counter()
+    try:
+        yield conn
+    except Exception:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    else:
+        if conn.in_transaction:
+            conn.commit()
+    finally:
+        load_time = time.perf_counter() - start
+        for pragma, value in previous.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        index_time = ensure_indexes(conn, tables)
+        print(f"▶ Bulk load: {load_time:.1f}s writing, {index_time:.1f}s index rebuild")
+
+
+def stage_updates(conn: sqlite3.Connection, rowids, values, reset: bool = False) -> int:
+    """
+    Append (rowid, value) pairs to the temp staging table read by apply_updates().
+    Can be called once per chunk, e.g. while streaming the table being labelled.
+    """
+    if reset:
+        conn.execute("DROP TABLE IF EXISTS temp.bulk_update_stage")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS bulk_update_stage (id INTEGER PRIMARY KEY, value)")
+    return conn.executemany(
+        "INSERT OR REPLACE INTO temp.bulk_update_stage (id, value) VALUES (?, ?)",
+        zip(map(int, rowids), (v.item() if hasattr(v, "item") else v for v in values)),
+    ).rowcount
+
+
+def apply_updates(conn: sqlite3.Connection, table: str, column: str) -> int:
+    """Apply the staged pairs to column of table in one set-based UPDATE ... FROM."""
+    updated = conn.execute(f"""
+        UPDATE {table} SET [{column}] = s.value
+        FROM temp.bulk_update_stage AS s
+        WHERE {table}.rowid = s.id
+    """).rowcount
+    conn.execute("DROP TABLE temp.bulk_update_stage")
+    return updated
+
+
+def bulk_update(conn: sqlite3.Connection, table: str, column: str, rowids, values) -> int:
+    """
+    Set column to values[i] on the row with rowid rowids[i] for all pairs at once:
+    the pairs are staged in a temp table with executemany and applied with one
+    set-based UPDATE instead of one UPDATE statement per row.
+    Returns the number of updated rows; committing is left to the caller.
+    """
+    stage_updates(conn, rowids, values, reset=True)
+    return apply_updates(conn, table, column)
+
+
+def time_query(conn: sqlite3.Connection, sql: str, params=()) -> float:
+    """Run sql to completion and return the elapsed time in seconds."""
+    start = time.perf_counter()
+    conn.execute(sql, params).fetchall()
+    return time.perf_counter() - start
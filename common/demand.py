@@ -0,0 +1,285 @@
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.calendar_dim import CALENDAR_TABLE, CalendarDimension
+from common.compact_schema import compact_name
+from common.trip_store import STORAGE_BACKEND, TRIP_SCHEMA, read_trips
+
+# ─── Demand aggregation ─────────────────────────────────────────────────
+# Trip counts per cluster and time key are computed inside SQLite, so the
+# trainers receive a few thousand count rows instead of millions of trips.
+# DemandCube holds the same counts as a dense array, zero-demand slots included.
+
+DEMAND_KEYS = ["cluster", "day", "hour", "special_day"]
+
+# SQL for every supported key over the hourly aggregate h (bucket = hour), the date map d
+# (d.date is 'YYYY-MM-DD') and the calendar_dim row c of that date
+KEY_SQL = {
+    "cluster": "h.cluster",
+    "date": "d.date",
+    "month": "substr(d.date, 1, 7)",
+    "day": "CAST(strftime('%d', d.date) AS INTEGER)",
+    "weekday": "(CAST(strftime('%w', d.date) AS INTEGER) + 6) % 7",  # Monday = 0 as in pandas
+    "hour": "h.bucket",
+    "special_day": "c.special_day_code",
+}
+
+
+def _time_sql(table: str):
+    """
+    (source table, date text expression, minute-of-day expression) for the configured
+    trip schema. <table>_compact must be migrated after table was built (see TRIP_SCHEMA).
+    """
+    if TRIP_SCHEMA == "compact":
+        return compact_name(table), "date(ts, 'unixepoch')", "(ts % 86400) / 60"
+    # text schema: '4/26/2014 12:26:57' (or ISO); the date part is parsed in Python once per distinct date
+    clock = "substr([Date/Time], instr([Date/Time], ' ') + 1)"
+    return (table,
+            "substr([Date/Time], 1, instr([Date/Time] || ' ', ' ') - 1)",
+            f"CAST({clock} AS INTEGER) * 60 + CAST(substr({clock}, instr({clock}, ':') + 1) AS INTEGER)")
+
+
+def _bucket_counts(conn: sqlite3.Connection, table: str, bucket_minutes: int, country: str,
+                   where: str = "") -> CalendarDimension:
+    """
+    Fill temp.demand_buckets (cluster, date_text, bucket, n) with one scan of the
+    trips (optionally restricted by the SQL predicate where) and temp.demand_dates
+    (date_text -> ISO date), and make sure calendar_dim knows every date.
+    Returns the calendar for country.
+    """
+    if 1440 % bucket_minutes:
+        raise ValueError(f"bucket_minutes must divide a day, got {bucket_minutes}")
+    source, date_sql, minute_sql = _time_sql(table)
+
+    # 1) One scan of the trips: counts per cluster, raw date and time bucket
+    conn.execute("DROP TABLE IF EXISTS temp.demand_buckets")
+    conn.execute(f"""
+        CREATE TEMP TABLE demand_buckets AS
+        SELECT cluster, {date_sql} AS date_text, ({minute_sql}) / {int(bucket_minutes)} AS bucket, COUNT(*) AS n
+        FROM {source}
+        WHERE cluster IS NOT NULL{f" AND ({where})" if where else ""}
+        GROUP BY 1, 2, 3
+    """)
+
+    # 2) Map the few distinct date strings to ISO dates and make sure calendar_dim knows them
+    date_text = pd.read_sql_query("SELECT DISTINCT date_text FROM temp.demand_buckets", conn)["date_text"]
+    parsed = pd.to_datetime(date_text, errors="coerce")
+    calendar = CalendarDimension.from_sql(conn, country)
+    calendar.label(parsed[parsed.notna()])
+    calendar.to_sql(conn)
+    conn.execute("DROP TABLE IF EXISTS temp.demand_dates")
+    conn.execute("CREATE TEMP TABLE demand_dates (date_text TEXT PRIMARY KEY, date TEXT)")
+    conn.executemany("INSERT INTO temp.demand_dates VALUES (?, ?)",
+                     zip(date_text[parsed.notna()], parsed[parsed.notna()].dt.strftime("%Y-%m-%d")))
+    return calendar
+
+
+def _drop_bucket_counts(conn: sqlite3.Connection):
+    conn.execute("DROP TABLE temp.demand_buckets")
+    conn.execute("DROP TABLE temp.demand_dates")
+    conn.commit()
+
+
+def demand_counts(conn: sqlite3.Connection, table: str, keys=DEMAND_KEYS, country: str = "US") -> pd.DataFrame:
+    """
+    Trip counts of table grouped by keys (see KEY_SQL), with special_day coded
+    0-3 from the shared calendar_dim table for country. The grouping and the
+    calendar join run in SQLite; only the aggregate is returned. Only
+    combinations with trips are returned; DemandCube adds the zeros.
+    """
+    keys = list(keys)
+    unknown = set(keys) - set(KEY_SQL)
+    if unknown:
+        raise ValueError(f"Unknown demand keys {sorted(unknown)} (expected any of {list(KEY_SQL)})")
+    if STORAGE_BACKEND == "parquet":
+        return _demand_counts_frame(conn, table, keys, country)
+
+    start = time.perf_counter()
+    _bucket_counts(conn, table, 60, country)
+
+    # 3) Join the calendar in SQL and aggregate to the requested keys
+    select = ", ".join(f"{KEY_SQL[k]} AS {k}" for k in keys)
+    counts = pd.read_sql_query(f"""
+        SELECT {select}, SUM(h.n) AS count
+        FROM temp.demand_buckets AS h
+        JOIN temp.demand_dates AS d ON d.date_text = h.date_text
+        JOIN {CALENDAR_TABLE} AS c ON c.date = d.date AND c.country = ?
+        GROUP BY {", ".join(str(i + 1) for i in range(len(keys)))}
+        ORDER BY {", ".join(str(i + 1) for i in range(len(keys)))}
+    """, conn, params=(country,))
+    _drop_bucket_counts(conn)
+
+    print(f"▶ Aggregated demand of '{table}' in SQLite to {len(counts)} rows "
+          f"({', '.join(keys)}) in {time.perf_counter() - start:.1f}s")
+    return counts
+
+
+def _demand_counts_frame(conn: sqlite3.Connection, table: str, keys, country: str) -> pd.DataFrame:
+    """Same result as demand_counts() for the Parquet backend, aggregated in pandas."""
+    df = read_trips(conn, table, columns=["Date/Time", "cluster"]).dropna(subset=["Date/Time", "cluster"])
+    calendar = CalendarDimension.from_sql(conn, country)
+    when = df["Date/Time"]
+    derived = {
+        "cluster": df["cluster"].astype(int),
+        "date": when.dt.strftime("%Y-%m-%d"),
+        "month": when.dt.strftime("%Y-%m"),
+        "day": when.dt.day,
+        "weekday": when.dt.weekday,
+        "hour": when.dt.hour,
+        "special_day": calendar.label(when, column="special_day_code"),
+    }
+    calendar.to_sql(conn)
+    conn.commit()
+    return pd.DataFrame({k: derived[k] for k in keys}).groupby(keys).size().reset_index(name="count")
+
+
+# ─── Dense demand cube ──────────────────────────────────────────────────
+
+def _dense_index(values: np.ndarray):
+    """(sorted distinct values, index of every value into them) for integers, in O(n) via bincount."""
+    if not len(values):
+        return values[:0], np.zeros(0, dtype=np.int64)
+    low = values.min()
+    present = np.bincount(values - low) > 0
+    position = np.cumsum(present) - 1
+    return np.flatnonzero(present) + low, position[values - low]
+
+
+class DemandCube:
+    """
+    Trip counts as a dense array [cluster, date, time bucket]: every cluster x
+    date x bucket slot exists, so hours without trips are explicit zeros instead
+    of missing groupby rows. The date axis holds the dates that have any trip
+    (months not in the data do not become zeros); bucket_minutes divides the day
+    (60 = hours, 15 = quarter hours). Counting is one np.bincount over flat
+    (cluster, date, bucket) indices.
+    """
+
+    def __init__(self, counts: np.ndarray, clusters, dates, bucket_minutes: int = 60,
+                 calendar: CalendarDimension = None):
+        self.counts = counts
+        self.clusters = np.asarray(clusters, dtype=np.int64)
+        self.dates = pd.DatetimeIndex(dates)
+        self.bucket_minutes = bucket_minutes
+        self.calendar = calendar
+
+    @property
+    def shape(self):
+        return self.counts.shape
+
+    @classmethod
+    def _count(cls, cluster, day, minute, bucket_minutes, weights=None, calendar=None,
+               clusters=None) -> "DemandCube":
+        """
+        Build the cube from integer cluster IDs, day numbers (days since epoch) and
+        minutes of day; clusters adds IDs that get an all-zero slice if they have no trips.
+        """
+        if 1440 % bucket_minutes:
+            raise ValueError(f"bucket_minutes must divide a day, got {bucket_minutes}")
+        if clusters is None:
+            clusters, cluster_idx = _dense_index(cluster)
+        else:
+            clusters = np.union1d(np.asarray(clusters, dtype=np.int64), cluster)
+            cluster_idx = np.searchsorted(clusters, cluster)
+        days, day_idx = _dense_index(day)
+        n_buckets = 1440 // bucket_minutes
+        flat = (cluster_idx * len(days) + day_idx) * n_buckets + minute // bucket_minutes
+        counts = np.bincount(flat, weights=weights, minlength=len(clusters) * len(days) * n_buckets)
+        counts = counts.astype(np.int64).reshape(len(clusters), len(days), n_buckets)
+        return cls(counts, clusters, days.astype("datetime64[D]"), bucket_minutes, calendar)
+
+    @classmethod
+    def from_trips(cls, timestamps, clusters, bucket_minutes: int = 60, calendar: CalendarDimension = None,
+                   cluster_ids=None) -> "DemandCube":
+        """Count raw trips (timestamps + cluster labels); trips without either are skipped."""
+        when = np.asarray(timestamps, dtype="datetime64[m]")
+        cluster = pd.to_numeric(pd.Series(clusters), errors="coerce").astype(float).to_numpy()
+        valid = ~np.isnat(when) & ~np.isnan(cluster)
+        when, cluster = when[valid], cluster[valid].astype(np.int64)
+        day = when.astype("datetime64[D]")
+        minute = (when - day).astype(np.int64)
+        return cls._count(cluster, day.astype(np.int64), minute, bucket_minutes, calendar=calendar,
+                          clusters=cluster_ids)
+
+    @classmethod
+    def from_sql(cls, conn: sqlite3.Connection, table: str, bucket_minutes: int = 60, country: str = "US",
+                 where: str = "", cluster_ids=None) -> "DemandCube":
+        """
+        Cube of table for the configured backend. With SQLite the trips are
+        pre-aggregated per (cluster, date, bucket) in SQL, optionally restricted
+        by the SQL predicate where, and the few thousand partial counts are
+        bincounted as weights. cluster_ids are kept even without trips.
+        """
+        start = time.perf_counter()
+        if STORAGE_BACKEND == "parquet":
+            if where:
+                raise ValueError("A SQL predicate cannot be applied to the Parquet backend")
+            trips = read_trips(conn, table, columns=["Date/Time", "cluster"])
+            calendar = CalendarDimension.from_sql(conn, country)
+            cube = cls.from_trips(trips["Date/Time"], trips["cluster"], bucket_minutes, calendar, cluster_ids)
+        else:
+            calendar = _bucket_counts(conn, table, bucket_minutes, country, where)
+            parts = pd.read_sql_query("""
+                SELECT h.cluster, d.date, h.bucket, h.n
+                FROM temp.demand_buckets AS h
+                JOIN temp.demand_dates AS d ON d.date_text = h.date_text
+            """, conn)
+            _drop_bucket_counts(conn)
+            day = pd.to_datetime(parts["date"]).to_numpy().astype("datetime64[D]").astype(np.int64)
+            cube = cls._count(parts["cluster"].to_numpy(np.int64), day,
+                              parts["bucket"].to_numpy(np.int64) * bucket_minutes, bucket_minutes,
+                              weights=parts["n"].to_numpy(float), calendar=calendar, clusters=cluster_ids)
+
+        # label the dates (also stores them in calendar_dim for the Parquet path)
+        cube.special_days()
+        cube.calendar.to_sql(conn)
+        conn.commit()
+        n_clusters, n_dates, n_buckets = cube.shape
+        zero = (cube.counts == 0).mean() if cube.counts.size else 0.0
+        print(f"▶ Built demand cube of '{table}': {n_clusters} clusters x {n_dates} dates x "
+              f"{n_buckets} buckets of {bucket_minutes} min ({int(cube.counts.sum())} trips, "
+              f"{zero:.1%} zero) in {time.perf_counter() - start:.1f}s")
+        return cube
+
+    def special_days(self) -> np.ndarray:
+        """special_day code (0-3, see calendar_dim) per date of the cube."""
+        if self.calendar is None:
+            raise ValueError("DemandCube has no calendar; pass one to label special days")
+        return self.calendar.label(pd.Series(self.dates), column="special_day_code").to_numpy(np.int64)
+
+    def to_frame(self, keys=None) -> pd.DataFrame:
+        """
+        Long-format frame with one row per cube slot (zeros included): cluster,
+        date, month, day, weekday, hour, minute, special_day (if the cube has a
+        calendar) and count. With keys (any of those columns) the counts are
+        summed to those keys; a key combination is zero if all its slots are.
+        """
+        n_clusters, n_dates, n_buckets = self.shape
+        date_idx = np.tile(np.repeat(np.arange(n_dates), n_buckets), n_clusters)
+        minute = np.tile(np.arange(n_buckets) * self.bucket_minutes, n_clusters * n_dates)
+        per_date = {
+            "date": self.dates.strftime("%Y-%m-%d").to_numpy(),
+            "month": self.dates.strftime("%Y-%m").to_numpy(),
+            "day": self.dates.day.to_numpy(),
+            "weekday": self.dates.weekday.to_numpy(),
+        }
+        if self.calendar is not None:
+            per_date["special_day"] = self.special_days()
+
+        frame = pd.DataFrame({"cluster": np.repeat(self.clusters, n_dates * n_buckets)})
+        for column, values in per_date.items():
+            frame[column] = values[date_idx]
+        frame["hour"] = minute // 60
+        frame["minute"] = minute % 60
+        frame["count"] = self.counts.ravel()
+        if keys is None:
+            return frame
+
+        keys = list(keys)
+        unknown = set(keys) - set(frame.columns)
+        if unknown:
+            raise ValueError(f"Unknown demand keys {sorted(unknown)} (expected any of {list(frame.columns[:-1])})")
+        return frame.groupby(keys, sort=True)["count"].sum().reset_index()
@@ -0,0 +1,224 @@
+import re
+import sqlite3
+import time
+
+import pandas as pd
+
+from common.compact_schema import compact_name
+from common.data_access import table_columns, table_exists
+from common.demand import DemandCube
+from common.trip_store import STORAGE_BACKEND, TRIP_SCHEMA
+
+# ─── Demand feature store ───────────────────────────────────────────────
+# One row per (source table, cluster, hour) with the trip count and the
+# calendar features of that hour, zero-demand hours included. The trainers and
+# the web interface read their features from here; refresh_features() only
+# aggregates trips appended since the last refresh (rowid watermark per source).
+
+FEATURE_TABLE = "demand_features"
+STATE_TABLE = "demand_features_state"
+
+# model inputs, in the order the per-cluster models were trained with
+FEATURE_COLUMNS = ["day", "hour", "special_day", "weekend_hour_interaction"]
+CALENDAR_COLUMNS = ["date", "month", "day", "weekday", "hour", "special_day", "is_weekend",
+                    "weekend_hour_interaction"]
+
+
+def add_calendar_features(frame: pd.DataFrame) -> pd.DataFrame:
+    """Derived features of frame's hour and special_day code (0-3); used for stored rows and requests alike."""
+    frame["is_weekend"] = frame["special_day"].isin([1, 2]).astype(int)
+    frame["weekend_hour_interaction"] = frame["is_weekend"] * frame["hour"]
+    return frame
+
+
+def ensure_feature_store(conn: sqlite3.Connection):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {FEATURE_TABLE} (
+            source                    TEXT,
+            cluster                   INTEGER,
+            ts                        TEXT,
+            date                      TEXT,
+            month                     TEXT,
+            day                       INTEGER,
+            weekday                   INTEGER,
+            hour                      INTEGER,
+            special_day               INTEGER,
+            is_weekend                INTEGER,
+            weekend_hour_interaction  INTEGER,
+            count                     INTEGER,
+            PRIMARY KEY (source, cluster, ts)
+        )
+    """)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+            source      TEXT PRIMARY KEY,
+            country     TEXT,
+            last_rowid  INTEGER,
+            refreshed   TEXT
+        )
+    """)
+
+
+def _has_rowid(conn: sqlite3.Connection, source: str) -> bool:
+    """Tables always have a rowid; views only if they expose one (see create_sample_view)."""
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (source,)).fetchone()
+    return kind is not None and (kind[0] == "table" or "rowid" in table_columns(conn, source))
+
+
+def _watermark(conn: sqlite3.Connection, source: str, last_rowid: int) -> int:
+    """
+    Highest rowid of source that can be aggregated: the newest row, or the row
+    before the first new trip still waiting for its cluster label (so it is
+    picked up by a later refresh instead of being skipped).
+    """
+    relation = compact_name(source) if TRIP_SCHEMA == "compact" else source
+    newest = conn.execute(f"SELECT MAX(rowid) FROM {relation}").fetchone()[0] or 0
+    unlabelled = conn.execute(
+        f"SELECT MIN(rowid) FROM {relation} WHERE rowid > ? AND cluster IS NULL", (last_rowid,)
+    ).fetchone()[0]
+    return newest if unlabelled is None else unlabelled - 1
+
+
+def refresh_features(conn: sqlite3.Connection, source: str, country: str = "US", full: bool = False) -> int:
+    """
+    Bring the feature rows of source up to date and return the number of trips
+    aggregated. Trips after the stored rowid watermark are counted into a demand
+    cube and added onto the stored hours (new dates arrive with their zero hours).
+    A first refresh, a different country, full=True or a source without rowids
+    (Parquet backend, views without a rowid column) rebuild the rows of source.
+    """
+    start = time.perf_counter()
+    ensure_feature_store(conn)
+    state = conn.execute(f"SELECT country, last_rowid FROM {STATE_TABLE} WHERE source = ?", (source,)).fetchone()
+    incremental = STORAGE_BACKEND == "sqlite" and (TRIP_SCHEMA == "compact" or _has_rowid(conn, source))
+    full = full or not incremental or state is None or state[1] is None or state[0] != country
+    last_rowid = 0 if full else state[1]
+
+    if not incremental:
+        until, where = 0, ""
+    else:
+        until = _watermark(conn, source, last_rowid)
+        if until <= last_rowid and not full:
+            print(f"▶ Features of '{source}' are up to date (rowid {last_rowid})")
+            return 0
+        where = f"rowid > {int(last_rowid)} AND rowid <= {int(until)}"
+
+    # 1) Dense hourly counts of the new trips, with every cluster already in the store
+    if full:
+        conn.execute(f"DELETE FROM {FEATURE_TABLE} WHERE source = ?", (source,))
+    known = [r[0] for r in conn.execute(f"SELECT DISTINCT cluster FROM {FEATURE_TABLE} WHERE source = ?", (source,))]
+    cube = DemandCube.from_sql(conn, source, bucket_minutes=60, country=country, where=where, cluster_ids=known)
+    frame = add_calendar_features(cube.to_frame())
+    frame["ts"] = frame["date"] + " " + frame["hour"].map("{:02d}:00:00".format)
+    frame.insert(0, "source", source)
+
+    # 2) Upsert: new hours are inserted, hours already stored get the new trips added
+    columns = ["source", "cluster", "ts"] + CALENDAR_COLUMNS + ["count"]
+    conn.execute("DROP TABLE IF EXISTS temp.feature_stage")
+    conn.execute(f"CREATE TEMP TABLE feature_stage AS SELECT {', '.join(columns)} FROM {FEATURE_TABLE} WHERE 0")
+    conn.executemany(f"INSERT INTO temp.feature_stage VALUES ({', '.join('?' * len(columns))})",
+                     frame[columns].itertuples(index=False, name=None))
+    conn.execute(f"""
+        INSERT INTO {FEATURE_TABLE} ({', '.join(columns)})
+        SELECT {', '.join(columns)} FROM temp.feature_stage WHERE true
+        ON CONFLICT (source, cluster, ts) DO UPDATE SET count = count + excluded.count
+    """)
+    conn.execute("DROP TABLE temp.feature_stage")
+    conn.execute(f"INSERT OR REPLACE INTO {STATE_TABLE} VALUES (?, ?, ?, ?)",
+                 (source, country, until, pd.Timestamp.now().isoformat(timespec="seconds")))
+    conn.commit()
+
+    trips = int(cube.counts.sum())
+    print(f"▶ {'Rebuilt' if full else 'Refreshed'} features of '{source}': {trips} trips into "
+          f"{len(frame)} cluster-hours in {time.perf_counter() - start:.1f}s")
+    return trips
+
+
+def refresh_all_features(conn: sqlite3.Connection, full: bool = False) -> int:
+    """Refresh every source the store already holds (e.g. after new trips were labelled)."""
+    if not table_exists(conn, STATE_TABLE):
+        return 0
+    trips = 0
+    for source, country in conn.execute(f"SELECT source, country FROM {STATE_TABLE}").fetchall():
+        relation = compact_name(source) if TRIP_SCHEMA == "compact" else source
+        if not table_exists(conn, relation):
+            print(f"⚠️ Features of '{source}' not refreshed: '{relation}' does not exist"
+                  + (" (run db_schema_migration.py)" if relation != source else ""))
+            continue
+        trips += refresh_features(conn, source, country, full)
+    return trips
+
+
+def invalidate_features(conn: sqlite3.Connection, sources=None):
+    """
+    Reset the watermark of sources (all if None) so their next refresh rebuilds
+    them, e.g. after trips were re-clustered or a sample table was recreated
+    (see invalidate_tables() for the sources built on a rewritten table).
+    """
+    if not table_exists(conn, STATE_TABLE):
+        return
+    if sources is None:
+        conn.execute(f"UPDATE {STATE_TABLE} SET last_rowid = NULL")
+    else:
+        conn.executemany(f"UPDATE {STATE_TABLE} SET last_rowid = NULL WHERE source = ?", [(s,) for s in sources])
+    conn.commit()
+
+
+def dependent_relations(conn: sqlite3.Connection, tables) -> set:
+    """tables plus every view that selects from one of them, directly or through other views."""
+    relations = set(tables)
+    views = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'view'").fetchall()
+    grown = True
+    while grown:
+        grown = False
+        for name, sql in views:
+            if name not in relations and any(re.search(rf"\b{re.escape(r)}\b", sql) for r in relations):
+                relations.add(name)
+                grown = True
+    return relations
+
+
+def invalidate_tables(conn: sqlite3.Connection, tables):
+    """
+    Invalidate the sources built on tables. Call it whenever a table is rebuilt
+    (rowids renumbered) or rows are deleted from it: the incremental refresh
+    only adds trips after the rowid watermark and would keep the old counts.
+    """
+    if table_exists(conn, STATE_TABLE):
+        stored = {r[0] for r in conn.execute(f"SELECT source FROM {STATE_TABLE}")}
+        invalidate_features(conn, sorted(stored & dependent_relations(conn, tables)))
+
+
+def read_features(conn: sqlite3.Connection, source: str, keys=None, clusters=None) -> pd.DataFrame:
+    """
+    Stored feature rows of source, one per (cluster, hour). With keys (any of
+    cluster and CALENDAR_COLUMNS) the counts are summed to those keys in SQL.
+    """
+    where, params = "source = ?", [source]
+    if clusters is not None:
+        clusters = [int(c) for c in clusters]
+        where += f" AND cluster IN ({', '.join('?' * len(clusters))})"
+        params += clusters
+    if keys is None:
+        return pd.read_sql_query(f"SELECT * FROM {FEATURE_TABLE} WHERE {where} ORDER BY cluster, ts",
+                                 conn, params=params)
+
+    keys = list(keys)
+    unknown = set(keys) - {"cluster"} - set(CALENDAR_COLUMNS)
+    if unknown:
+        raise ValueError(f"Unknown feature keys {sorted(unknown)} (expected cluster or any of {CALENDAR_COLUMNS})")
+    group = ", ".join(str(i + 1) for i in range(len(keys)))
+    return pd.read_sql_query(f"""
+        SELECT {', '.join(keys)}, SUM(count) AS count
+        FROM {FEATURE_TABLE}
+        WHERE {where}
+        GROUP BY {group}
+        ORDER BY {group}
+    """, conn, params=params)
+
+
+def feature_clusters(conn: sqlite3.Connection) -> list:
+    """Cluster IDs present in the feature store (empty if it has not been built)."""
+    if not table_exists(conn, FEATURE_TABLE):
+        return []
+    return [r[0] for r in conn.execute(f"SELECT DISTINCT cluster FROM {FEATURE_TABLE} ORDER BY cluster")]
@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch (KLL-style stack of compactors).
+
+    Values are fed chunk by chunk with update(). Whenever a level holds more than
+    k values it is sorted and every other value (random offset) is promoted to the
+    next level with twice the weight. With k = ceil(2 / eps) the rank error of a
+    quantile query is about eps * n / 4 (one standard deviation), while memory stays
+    at O(k * log2(n / k)) values. Sketches built with the same eps on different
+    partitions or processes can be combined with merge(). min and max are exact.
+    """
+
+    def __init__(self, eps: float = 1e-4, seed: int = 42):
+        self.eps = eps
+        self.k = int(np.ceil(2 / eps))
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values) -> "QuantileSketch":
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return self
+        self.count += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+        return self
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.k != self.k:
+            raise ValueError(f"Cannot merge sketches with different k ({self.k} vs {other.k})")
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, items in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self._compact()
+        return self
+
+    def _compact(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.k:
+                buf = np.sort(self.levels[h])
+                # an odd item out stays at this level so total weight is preserved exactly
+                keep, buf = (buf[-1:], buf[:-1]) if len(buf) % 2 else (np.empty(0), buf)
+                promoted = buf[self._rng.integers(2)::2]
+                self.levels[h] = keep
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+            h += 1
+
+    def quantiles(self, qs) -> np.ndarray:
+        """Approximate quantiles for the probabilities in qs (0 and 1 return exact min/max)."""
+        qs = np.atleast_1d(np.asarray(qs, dtype=float))
+        if not self.count:
+            return np.full(len(qs), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(lvl), 2.0 ** h) for h, lvl in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        items, cum_weights = items[order], np.cumsum(weights[order])
+
+        idx = np.searchsorted(cum_weights, qs * cum_weights[-1], side="left")
+        result = items[np.clip(idx, 0, len(items) - 1)]
+        result[qs <= 0] = self.min
+        result[qs >= 1] = self.max
+        return result
+
+    def quantile(self, q: float) -> float:
+        return float(self.quantiles([q])[0])
+
+    def median(self) -> float:
+        return self.quantile(0.5)
+
+    @property
+    def size(self) -> int:
+        """Number of values currently retained."""
+        return sum(len(lvl) for lvl in self.levels)
@@ -0,0 +1,163 @@
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from common.compact_schema import compact_name, migrate_view
+from common.data_access import table_columns, table_exists
+from common.db_maintenance import apply_updates, bulk_load, stage_updates
+
+# ─── Config ─────────────────────────────────────────────────────────────
+SAMPLE_CHUNK_SIZE = 500_000
+# strata that can be sampled by; month is derived from Date/Time ('YYYY-MM'),
+# the others are read as stored
+STRATA_COLUMNS = ("month", "cluster", "special_day")
+
+# Hash-based sampling: every trip gets a stable bucket 0..SAMPLE_BUCKETS-1 from
+# a hash of its content, and a fraction f is the predicate sample_bucket < f * SAMPLE_BUCKETS.
+# Samples therefore nest (5% ⊂ 10% ⊂ 100%) and are the same in every table holding the trip.
+SAMPLE_BUCKETS = 10_000
+BUCKET_COLUMN = "sample_bucket"
+HASH_COLUMNS = ["Date/Time", "Lat", "Lon", "Base"]
+
+
+def _drop_relation(conn: sqlite3.Connection, name: str):
+    """Drop name whether it is a table or a view (the training sets can be either)."""
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (name,)).fetchone()
+    if kind:
+        conn.execute(f"DROP {kind[0].upper()} {name}")
+
+
+def _strata_chunks(conn: sqlite3.Connection, table: str, strata, chunk_size: int):
+    """
+    Yield (rowid, month, strata frame) per chunk, dropping rows without a date or
+    position. month is the integer code year * 100 + month (e.g. 201404).
+    """
+    stored = [c for c in strata if c != "month"]
+    select = ", ".join(["rowid", "[Date/Time]"] + [f"[{c}]" for c in stored])
+    query = f"SELECT {select} FROM {table} WHERE Lat IS NOT NULL AND Lon IS NOT NULL"
+    for chunk in pd.read_sql_query(query, conn, chunksize=chunk_size):
+        parsed = pd.to_datetime(chunk["Date/Time"], errors="coerce")
+        valid = parsed.notna()
+        chunk = chunk[valid].assign(month=(parsed[valid].dt.year * 100 + parsed[valid].dt.month).astype(np.int64))
+        yield chunk["rowid"].to_numpy(), chunk["month"].to_numpy(), chunk[list(strata)]
+
+
+def stratified_sample(conn: sqlite3.Connection, source: str, target: str, fraction: float,
+                      strata=("month",), seed: int = 42, chunk_size: int = SAMPLE_CHUNK_SIZE) -> int:
+    """
+    Write a stratified random sample of source into target: round(fraction * n)
+    rows of every stratum (combination of the strata columns), like
+    groupby(strata).sample(frac=fraction) but streamed. Only rowid, stratum code
+    and a random key per row are held in memory; the rows themselves are copied
+    with one INSERT ... SELECT. target gets the source columns plus 'month'
+    ('YYYY-MM') unless source already has one.
+    Returns the number of sampled rows.
+    """
+    strata = list(strata)
+    source_columns = table_columns(conn, source)
+    unknown = set(strata) - set(STRATA_COLUMNS)
+    missing = set(strata) - {"month"} - set(source_columns)
+    if unknown or missing:
+        raise ValueError(f"Cannot stratify {source} by {sorted(unknown | missing)}")
+    if not 0 < fraction <= 1:
+        raise ValueError(f"fraction must be in (0, 1], got {fraction}")
+
+    # 1) One streaming pass: stratum code and random key per row
+    start = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    codes = {}
+    rowids, months, stratum_ids = [], [], []
+    for rowid, month, keys in _strata_chunks(conn, source, strata, chunk_size):
+        groups = keys.groupby(strata, sort=False, dropna=False)
+        local = groups.ngroup().to_numpy()
+        mapping = np.array([codes.setdefault(k, len(codes)) for k in groups.size().index])
+        rowids.append(rowid)
+        months.append(month)
+        stratum_ids.append(mapping[local])
+    rowid, month, stratum = (np.concatenate(a) if a else np.empty(0, dtype=np.int64)
+                             for a in (rowids, months, stratum_ids))
+    stratum = stratum.astype(np.int64)
+
+    # 2) Per stratum keep the round(fraction * n) rows with the smallest random keys
+    order = np.lexsort((rng.random(len(rowid)), stratum))
+    sizes = np.bincount(stratum, minlength=len(codes))
+    take = np.round(sizes * fraction).astype(np.int64)
+    first = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    rank = np.arange(len(order)) - first[stratum[order]]
+    selected = np.sort(order[rank < take[stratum[order]]])
+
+    # 3) Copy the selected rows with their month in one INSERT ... SELECT
+    # (a source that already has a month column keeps its own, no duplicate 'month:1')
+    month_sql = "" if "month" in source_columns else ", printf('%04d-%02d', t.month / 100, t.month % 100) AS month"
+    with bulk_load(conn, [target]):
+        conn.execute("DROP TABLE IF EXISTS temp.sample_rows")
+        conn.execute("CREATE TEMP TABLE sample_rows (id INTEGER PRIMARY KEY, month INTEGER)")
+        conn.executemany("INSERT INTO temp.sample_rows VALUES (?, ?)",
+                         zip(rowid[selected].tolist(), month[selected].tolist()))
+        _drop_relation(conn, target)
+        conn.execute(f"""
+            CREATE TABLE {target} AS
+            SELECT s.*{month_sql}
+            FROM {source} AS s JOIN temp.sample_rows AS t ON s.rowid = t.id
+            ORDER BY s.rowid
+        """)
+        conn.execute("DROP TABLE temp.sample_rows")
+
+    print(f"▶ Sampled {len(selected)} of {len(rowid)} rows ({fraction:.0%} per {'/'.join(strata)}, "
+          f"{len(codes)} strata) from '{source}' into '{target}' in {time.perf_counter() - start:.1f}s")
+    return len(selected)
+
+
+# ─── Hash-based nested samples ──────────────────────────────────────────
+
+def sample_buckets(trips: pd.DataFrame) -> np.ndarray:
+    """Stable bucket (0..SAMPLE_BUCKETS-1) per trip, hashed from its HASH_COLUMNS."""
+    hashes = pd.util.hash_pandas_object(trips[HASH_COLUMNS], index=False).to_numpy()
+    return (hashes % np.uint64(SAMPLE_BUCKETS)).astype(np.int64)
+
+
+def assign_sample_buckets(conn: sqlite3.Connection, table: str, only_missing: bool = True,
+                          chunk_size: int = SAMPLE_CHUNK_SIZE) -> int:
+    """
+    Fill the sample_bucket column of table (added if missing), by default only
+    for rows that have none yet, so newly ingested trips are bucketed incrementally.
+    Returns the number of rows bucketed.
+    """
+    start = time.perf_counter()
+    if BUCKET_COLUMN not in table_columns(conn, table):
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {BUCKET_COLUMN} INTEGER")
+    select = ", ".join(["rowid"] + [f"[{c}]" for c in HASH_COLUMNS])
+    where = f" WHERE {BUCKET_COLUMN} IS NULL" if only_missing else ""
+
+    rows = 0
+    stage_updates(conn, [], [], reset=True)
+    for chunk in pd.read_sql_query(f"SELECT {select} FROM {table}{where}", conn, chunksize=chunk_size):
+        rows += stage_updates(conn, chunk["rowid"].to_numpy(), sample_buckets(chunk))
+    apply_updates(conn, table, BUCKET_COLUMN)
+    conn.commit()
+    print(f"▶ Assigned sample buckets to {rows} rows of '{table}' in {time.perf_counter() - start:.1f}s")
+    return rows
+
+
+def sample_predicate(fraction: float) -> str:
+    """SQL predicate selecting the hash sample of the given fraction."""
+    if not 0 < fraction <= 1:
+        raise ValueError(f"fraction must be in (0, 1], got {fraction}")
+    return f"{BUCKET_COLUMN} < {int(round(fraction * SAMPLE_BUCKETS))}"
+
+
+def create_sample_view(conn: sqlite3.Connection, source: str, view: str, fraction: float):
+    """
+    (Re)create view as the hash sample of source; a physical table of that name is
+    replaced. The view exposes the source rowid, so it can be read incrementally.
+    If source has a compact counterpart, <view>_compact is recreated over it as well.
+    """
+    _drop_relation(conn, view)
+    conn.execute(f"CREATE VIEW {view} AS SELECT rowid AS rowid, * FROM {source} WHERE {sample_predicate(fraction)}")
+    conn.commit()
+    count = conn.execute(f"SELECT COUNT(*) FROM {view}").fetchone()[0]
+    print(f"▶ View '{view}' = {fraction:.0%} hash sample of '{source}' ({count} rows)")
+    if table_exists(conn, compact_name(source)):
+        migrate_view(conn, view)
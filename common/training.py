@@ -0,0 +1,169 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import KFold, ParameterGrid
+from threadpoolctl import threadpool_limits
+
+# ─── Joint cluster x parameter x fold scheduler ─────────────────────────
+# A per-cluster GridSearchCV(n_jobs=-1) starts a worker pool for a few thousand
+# rows and leaves the cores idle between clusters. Here every (cluster, parameter
+# set, CV fold) fit is one task of a single process pool; the training data is
+# sent to each worker once (pool initializer) and tasks only carry indices.
+# Native thread pools (OpenMP in HistGradientBoosting, BLAS) are limited to
+# cores // workers per worker so processes x threads does not oversubscribe.
+
+_DATA = {}
+
+
+def _init_worker(data: dict, threads: int):
+    _DATA.update(data)
+    _DATA["limits"] = threadpool_limits(threads)
+
+
+def _fit_fold(task):
+    """Fit one parameter set on one fold of one cluster; returns (task, test score, fit seconds, test predictions)."""
+    cluster, p, fold = task
+    X, y = _DATA["frames"][cluster]
+    train, test = _DATA["folds"][cluster][fold]
+    start = time.perf_counter()
+    model = clone(_DATA["estimator"]).set_params(**_DATA["params"][p])
+    model.fit(X.iloc[train], y[train])
+    fit_time = time.perf_counter() - start
+    return task, _DATA["scorer"](model, X.iloc[test], y[test]), fit_time, model.predict(X.iloc[test])
+
+
+def _refit(task):
+    """Refit the selected parameter set of a cluster on all its rows."""
+    cluster, p = task
+    X, y = _DATA["frames"][cluster]
+    return cluster, clone(_DATA["estimator"]).set_params(**_DATA["params"][p]).fit(X, y)
+
+
+def cluster_test_folds(clusters, cv=5) -> np.ndarray:
+    """
+    Test fold of every row when each cluster is split by its own KFold(cv) (or the
+    given splitter), as in the per-cluster search. Used as PredefinedSplit(test_fold)
+    for one model over all clusters, so both are scored on the same train/test rows.
+    """
+    clusters = np.asarray(clusters)
+    splitter = KFold(n_splits=cv) if isinstance(cv, int) else cv
+    test_fold = np.empty(len(clusters), dtype=np.int64)
+    for c in np.unique(clusters):
+        rows = np.flatnonzero(clusters == c)
+        for f, (_, test) in enumerate(splitter.split(rows)):
+            test_fold[rows[test]] = f
+    return test_fold
+
+
+def halving_rounds(n_candidates: int, factor: int = 3) -> int:
+    """Rounds of successive halving until one parameter set is left (1 + floor(log_factor(n)))."""
+    return 1 + int(np.floor(np.log(max(n_candidates, 1)) / np.log(factor) + 1e-9))
+
+
+def parallel_search(frames: dict, estimator, param_grid, cv=5, scoring: str = "neg_mean_absolute_error",
+                    workers: int = None, method: str = "grid", factor: int = 3, budget_s: float = None,
+                    max_fits: int = None) -> dict:
+    """
+    Hyperparameter search for many clusters at once. frames maps cluster -> (X, y);
+    all cluster x parameter set x KFold(cv) fits of a round run in one pool of
+    workers (default: all cores), followed by one refit of the best set per cluster.
+    cv is a number of KFold splits or a splitter (e.g. PredefinedSplit).
+
+    method="grid" scores every set on all folds (same selection as GridSearchCV).
+    method="halving" runs successive halving per cluster with CV folds as the
+    resource: round r scores the remaining sets on the first
+    ceil(cv * factor**-(rounds - 1 - r)) folds and keeps the best 1/factor.
+    Fold scores carry over between rounds (a fold fit does not depend on the
+    round), so the last round only fits the missing folds and the winner's score
+    is its ordinary cv-fold score. A round that would start after budget_s
+    seconds or exceed max_fits fits in total is not run; the best set of the last
+    completed round then wins, scored on fewer folds (best_resource < 1). The
+    budget only applies to halving, and max_fits must cover round 0. With an
+    unshuffled KFold the early rounds only see the first rows (e.g. the first
+    days), so pass a shuffled splitter for halving.
+
+    Returns cluster -> {best_params, best_estimator, best_score, best_resource,
+    oof_predictions, cv_results}, with one cv_results row per evaluated (round,
+    parameter set); oof_predictions holds the winner's out-of-fold prediction per
+    row (NaN for folds it was not scored on).
+    """
+    if method not in ("grid", "halving"):
+        raise ValueError(f"Unknown search method '{method}' (expected 'grid' or 'halving')")
+    if method == "grid" and (budget_s is not None or max_fits is not None):
+        raise ValueError("A search budget (budget_s / max_fits) only applies to method='halving'")
+    workers = workers or os.cpu_count()
+    params = list(ParameterGrid(param_grid))
+    frames = {c: (X, np.asarray(y)) for c, (X, y) in frames.items()}
+    splitter = KFold(n_splits=cv) if isinstance(cv, int) else cv
+    folds = {c: list(splitter.split(X, y)) for c, (X, y) in frames.items()}
+    cv = splitter.get_n_splits()
+    data = {"frames": frames, "folds": folds, "params": params,
+            "estimator": estimator, "scorer": get_scorer(scoring)}
+    rounds = halving_rounds(len(params), factor) if method == "halving" else 1
+    first_fits = len(frames) * len(params) * min(cv, int(np.ceil(cv * float(factor) ** (1 - rounds))))
+    if max_fits is not None and max_fits < first_fits:
+        raise ValueError(f"max_fits={max_fits} is below the {first_fits} fits of the first halving round")
+
+    start = time.perf_counter()
+    alive = {c: list(range(len(params))) for c in frames}
+    scores, fit_times, predictions = {}, {}, {}  # (cluster, parameter set, fold) -> value, kept across rounds
+    best, records, fits, completed = {}, [], 0, 0
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(data, threads)) as pool:
+        for r in range(rounds):
+            n_folds = min(cv, int(np.ceil(cv * float(factor) ** (r - rounds + 1))))
+            tasks = [(c, p, f) for c in frames for p in alive[c] for f in range(n_folds) if (c, p, f) not in scores]
+            over_time = budget_s is not None and time.perf_counter() - start > budget_s
+            over_fits = max_fits is not None and fits + len(tasks) > max_fits
+            if r and (over_time or over_fits):
+                print(f"⚠️ Search budget reached: stopping after {r} of {rounds} rounds "
+                      f"({fits} fits, {time.perf_counter() - start:.1f}s)")
+                break
+
+            chunksize = max(1, len(tasks) // (workers * 4))
+            for task, score, fit_time, prediction in pool.map(_fit_fold, tasks, chunksize=chunksize):
+                scores[task], fit_times[task], predictions[task] = score, fit_time, prediction
+            fits += len(tasks)
+            completed += 1
+
+            # keep the best 1/factor per cluster (stable sort: first parameter set on ties)
+            for c in frames:
+                fold_scores = {p: [scores[(c, p, f)] for f in range(n_folds)] for p in alive[c]}
+                mean = {p: np.mean(v) for p, v in fold_scores.items()}
+                records += [{"cluster": c, "round": r, "n_folds": n_folds, "params": params[p],
+                             "mean_test_score": mean[p], "std_test_score": np.std(fold_scores[p]),
+                             "mean_fit_time": np.mean([fit_times[(c, p, f)] for f in range(n_folds)])}
+                            for p in alive[c]]
+                ranked = sorted(alive[c], key=lambda p: -mean[p])
+                best[c] = (ranked[0], mean[ranked[0]], n_folds / cv)
+                alive[c] = sorted(ranked[:max(1, int(np.ceil(len(ranked) / factor)))])
+
+        refits = dict(pool.map(_refit, [(c, p) for c, (p, _, _) in best.items()]))
+    print(f"▶ {method.capitalize()} search of {len(params)} parameter sets x {cv} folds for {len(frames)} clusters "
+          f"({fits} fits in {completed} rounds) in {time.perf_counter() - start:.1f}s on {workers} workers")
+
+    oof = {c: np.full(len(y), np.nan) for c, (_, y) in frames.items()}
+    for c, (p, _, _) in best.items():
+        for f, (_, test) in enumerate(folds[c]):
+            if (c, p, f) in predictions:
+                oof[c][test] = predictions[(c, p, f)]
+
+    cv_results = pd.DataFrame(records)
+    cv_results["rank_test_score"] = (cv_results.groupby(["cluster", "round"])["mean_test_score"]
+                                     .rank(method="min", ascending=False).astype(int))
+    return {
+        c: {
+            "best_params": params[p],
+            "best_estimator": refits[c],
+            "best_score": score,
+            "best_resource": resource,
+            "oof_predictions": oof[c],
+            "cv_results": cv_results[cv_results["cluster"] == c].drop(columns="cluster").reset_index(drop=True),
+        }
+        for c, (p, score, resource) in best.items()
+    }
@@ -0,0 +1,112 @@
+import os
+import shutil
+import sqlite3
+from pathlib import Path
+
+import pandas as pd
+
+from common.compact_schema import read_compact
+
+# ─── Config ─────────────────────────────────────────────────────────────
+# 'sqlite' reads trip tables from data_consolidated.db (default),
+# 'parquet' reads the Parquet datasets exported next to it.
+STORAGE_BACKEND = os.environ.get("TRIP_STORAGE_BACKEND", "sqlite")
+PARQUET_ROOT = Path(os.environ.get(
+    "TRIP_PARQUET_ROOT",
+    Path(__file__).resolve().parents[1] / "data_acquisition" / "data_ingest" / "parquet"
+))
+# 'text' reads the original tables, 'compact' their <table>_compact counterparts
+# (epoch timestamps, integer codes; see common/compact_schema.py). The compact tables are
+# copies: cluster_simulation.py and assign_clusters.py label them as well, but a table that
+# is rebuilt (IQR/DBSCAN stages, stratified samples) must be re-migrated with db_schema_migration.py.
+TRIP_SCHEMA = os.environ.get("TRIP_SCHEMA", "text")
+EXPORT_CHUNK_SIZE = 500_000
+
+
+def partition_columns(columns) -> list:
+    """Trip tables are partitioned by month, and by cluster once it has been assigned."""
+    return ["month", "cluster"] if "cluster" in columns else ["month"]
+
+
+def export_table(conn: sqlite3.Connection, table: str, root: Path = PARQUET_ROOT) -> Path:
+    """
+    Mirror a SQLite trip table into a hive-partitioned Parquet dataset under root/table.
+    The table is streamed in EXPORT_CHUNK_SIZE row chunks and Date/Time is stored
+    as a real timestamp, so readers never parse the string again.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    target = Path(root) / table
+    if target.exists():
+        shutil.rmtree(target)
+
+    rows = 0
+    query = f"SELECT * FROM {table}"
+    for i, chunk in enumerate(pd.read_sql_query(query, conn, chunksize=EXPORT_CHUNK_SIZE)):
+        chunk["Date/Time"] = pd.to_datetime(chunk["Date/Time"])
+        chunk["month"] = chunk["Date/Time"].dt.strftime("%Y-%m")
+        partitions = partition_columns(chunk.columns)
+        if "cluster" in partitions:
+            # unlabelled trips stay NULL (hive default partition), not a cluster of their own
+            chunk["cluster"] = chunk["cluster"].astype("Int64")
+
+        ds.write_dataset(
+            pa.Table.from_pandas(chunk, preserve_index=False),
+            target,
+            format="parquet",
+            partitioning=partitions,
+            partitioning_flavor="hive",
+            basename_template=f"chunk{i:05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        rows += len(chunk)
+
+    print(f"▶ Exported {rows} rows of '{table}' to {target}")
+    return target
+
+
+def read_trips(conn: sqlite3.Connection, table: str, columns=None, months=None, clusters=None,
+               backend: str = None) -> pd.DataFrame:
+    """
+    Load a trip table from the configured backend, returning only the requested
+    columns of the requested months ('YYYY-MM') and clusters.
+    Date/Time is always returned as datetime64.
+    """
+    backend = backend or STORAGE_BACKEND
+
+    if backend == "parquet":
+        import pyarrow.dataset as ds
+
+        dataset = ds.dataset(Path(PARQUET_ROOT) / table, format="parquet", partitioning="hive")
+        flt = None
+        if months is not None:
+            flt = ds.field("month").isin(list(months))
+        if clusters is not None:
+            cluster_flt = ds.field("cluster").isin([int(c) for c in clusters])
+            flt = cluster_flt if flt is None else flt & cluster_flt
+        return dataset.to_table(columns=columns, filter=flt).to_pandas()
+
+    if backend != "sqlite":
+        raise ValueError(f"Unknown storage backend '{backend}' (expected 'sqlite' or 'parquet')")
+
+    select_cols = list(columns) if columns else None
+    if months is not None and select_cols and "Date/Time" not in select_cols:
+        select_cols.append("Date/Time")
+    where, params = "", []
+    if clusters is not None:
+        params = [int(c) for c in clusters]
+        where = f"cluster IN ({', '.join('?' * len(params))})"
+
+    if TRIP_SCHEMA == "compact":
+        df = read_compact(conn, table, select_cols, where, params)
+    else:
+        select = ", ".join(f"[{c}]" for c in select_cols) if select_cols else "*"
+        query = f"SELECT {select} FROM {table}"
+        df = pd.read_sql_query(f"{query} WHERE {where}" if where else query, conn, params=params)
+
+    if "Date/Time" in df.columns:
+        df["Date/Time"] = pd.to_datetime(df["Date/Time"])
+    if months is not None:
+        df = df[df["Date/Time"].dt.strftime("%Y-%m").isin(list(months))]
+    return df[list(columns)] if columns else df
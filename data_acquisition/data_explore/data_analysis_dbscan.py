@@ -0,0 +1,176 @@
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import DBSCAN
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.data_access import connect, resolve_db_path, table_columns
+from common.db_maintenance import bulk_load
+from common.feature_store import invalidate_tables
+from common.trip_store import STORAGE_BACKEND, export_table
+
+# --- CONFIGURATION ---
+
+source_table = "taxi_input_model_unrestricted"
+target_table = "taxi_input_model_dbscan"
+eps_m        = 100      # neighbourhood radius in metres (haversine)
+min_samples  = 10       # trips within eps_m (incl. the point itself) to be a core point
+tile_deg     = 0.02     # tile edge in degrees (~2 km); bounds the points one DBSCAN fit sees
+workers      = 4        # >1 fits tiles in a process pool; at most workers+1 tiles are in flight
+# rows with a usable position; anything else is left unflagged (NULL) and excluded
+valid_coords = "typeof(Lat) IN ('real', 'integer') AND typeof(Lon) IN ('real', 'integer')"
+
+EARTH_RADIUS_M = 6_371_000
+# flag columns written in place by the outlier stages; never copied into their outputs
+OUTLIER_COLUMNS = ("iqr_outlier", "dbscan_outlier")
+
+
+# --- SPATIAL TILES ---
+
+def load_positions(conn):
+    """
+    Distinct valid positions with their trip counts. Repeated GPS fixes collapse
+    into one weighted point, so memory scales with distinct positions, not trips.
+    """
+    df = pd.read_sql_query(
+        f"SELECT Lat, Lon, COUNT(*) AS n FROM {source_table} WHERE {valid_coords} GROUP BY Lat, Lon", conn
+    )
+    return df["Lat"].to_numpy(float), df["Lon"].to_numpy(float), df["n"].to_numpy()
+
+
+def build_tiles(lat: np.ndarray, lon: np.ndarray) -> dict:
+    """Map (tile_y, tile_x) -> indices of the positions inside that tile."""
+    tile_y = np.floor(lat / tile_deg).astype(np.int64)
+    tile_x = np.floor(lon / tile_deg).astype(np.int64)
+    order = np.lexsort((tile_x, tile_y))
+    keys, starts = np.unique(np.column_stack([tile_y[order], tile_x[order]]), axis=0, return_index=True)
+    bounds = np.append(starts, len(order))
+    return {(int(y), int(x)): order[bounds[i]:bounds[i + 1]] for i, (y, x) in enumerate(keys)}
+
+
+def tile_tasks(lat: np.ndarray, lon: np.ndarray, weight: np.ndarray, tiles: dict):
+    """
+    Yield (core indices, lat, lon, weight) per tile, core positions first and
+    followed by a halo of 2 * eps_m around the tile. A point's noise label only
+    depends on points within 2 * eps_m (its neighbours and theirs), so the
+    per-tile labels of the core positions equal those of a global DBSCAN.
+    """
+    halo_lat = 2 * np.degrees(eps_m / EARTH_RADIUS_M) * 1.01
+    for (ty, tx), core in tiles.items():
+        lat0, lat1 = ty * tile_deg - halo_lat, (ty + 1) * tile_deg + halo_lat
+        # longitude degrees shrink towards the poles; size the halo for the tile's worst latitude
+        cos_lat = np.cos(np.radians(min(max(abs(lat0), abs(lat1)), 89.9)))
+        halo_lon = halo_lat / cos_lat
+        lon0, lon1 = tx * tile_deg - halo_lon, (tx + 1) * tile_deg + halo_lon
+
+        ry, rx = int(np.ceil(halo_lat / tile_deg)), int(np.ceil(halo_lon / tile_deg))
+        neighbours = [tiles[(ty + dy, tx + dx)]
+                      for dy in range(-ry, ry + 1) for dx in range(-rx, rx + 1)
+                      if (dy or dx) and (ty + dy, tx + dx) in tiles]
+        halo = np.concatenate(neighbours) if neighbours else np.empty(0, dtype=np.int64)
+        halo = halo[(lat[halo] >= lat0) & (lat[halo] <= lat1) & (lon[halo] >= lon0) & (lon[halo] <= lon1)]
+
+        idx = np.concatenate([core, halo])
+        yield core, lat[idx], lon[idx], weight[idx]
+
+
+def fit_tile(lat: np.ndarray, lon: np.ndarray, weight: np.ndarray, n_core: int, eps: float, min_samples: int):
+    """DBSCAN on one tile (haversine ball tree); returns the noise mask of its core positions."""
+    coords = np.radians(np.column_stack([lat, lon]))
+    labels = DBSCAN(
+        eps=eps, min_samples=min_samples, metric="haversine", algorithm="ball_tree"
+    ).fit(coords, sample_weight=weight).labels_
+    return labels[:n_core] == -1
+
+
+def fit_serial(tasks):
+    for core, lat, lon, weight in tasks:
+        yield core, fit_tile(lat, lon, weight, len(core), eps_m / EARTH_RADIUS_M, min_samples)
+
+
+def fit_parallel(tasks):
+    """Fit tiles in a pool of `workers` processes with only `workers` tiles queued ahead."""
+    eps = eps_m / EARTH_RADIUS_M
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        queue = deque(
+            (core, pool.submit(fit_tile, lat, lon, weight, len(core), eps, min_samples))
+            for core, lat, lon, weight in islice(tasks, workers)
+        )
+        while queue:
+            core, future = queue.popleft()
+            for nxt_core, lat, lon, weight in islice(tasks, 1):
+                queue.append((nxt_core, pool.submit(fit_tile, lat, lon, weight, len(nxt_core), eps, min_samples)))
+            yield core, future.result()
+
+
+def main():
+    # 1) Locate the DB that has our table
+    db_path = resolve_db_path(source_table)
+    print(f"▶ Using database: {db_path}")
+    conn = connect(db_path)
+    start = time.perf_counter()
+
+    # 2) Aggregate the trips to distinct weighted positions and bin them into tiles
+    lat, lon, weight = load_positions(conn)
+    tiles = build_tiles(lat, lon)
+    print(f"✅ {weight.sum()} trips at {len(lat)} distinct positions in {len(tiles)} tiles "
+          f"of {tile_deg}° ({time.perf_counter() - start:.1f}s)")
+
+    # 3) DBSCAN per tile (with halo), in parallel when workers > 1
+    fit_start = time.perf_counter()
+    noise = np.zeros(len(lat), dtype=bool)
+    fit = fit_parallel if workers > 1 and len(tiles) > 1 else fit_serial
+    for core, core_noise in fit(tile_tasks(lat, lon, weight, tiles)):
+        noise[core] = core_noise
+    print(f"📐 DBSCAN (eps={eps_m} m, min_samples={min_samples}): {noise.sum()} noise positions, "
+          f"{weight[noise].sum()} trips, in {time.perf_counter() - fit_start:.1f}s (workers={workers})")
+
+    with bulk_load(conn, [source_table, target_table], drop_existing_indexes=False):
+        # 4) Flag outliers in place in column 'dbscan_outlier' via a temp table of noise positions
+        conn.execute("DROP TABLE IF EXISTS temp.dbscan_noise")
+        conn.execute("CREATE TEMP TABLE dbscan_noise (Lat REAL, Lon REAL, PRIMARY KEY (Lat, Lon)) WITHOUT ROWID")
+        conn.executemany("INSERT INTO temp.dbscan_noise VALUES (?, ?)", zip(lat[noise].tolist(), lon[noise].tolist()))
+        if "dbscan_outlier" not in table_columns(conn, source_table):
+            conn.execute(f"ALTER TABLE {source_table} ADD COLUMN dbscan_outlier TEXT")
+        conn.execute(f"""
+            UPDATE {source_table}
+            SET dbscan_outlier = CASE
+                WHEN NOT ({valid_coords}) THEN NULL
+                WHEN EXISTS (SELECT 1 FROM temp.dbscan_noise n
+                             WHERE n.Lat = {source_table}.Lat AND n.Lon = {source_table}.Lon)
+                THEN 'YES' ELSE 'NO'
+            END
+        """)
+        conn.execute("DROP TABLE temp.dbscan_noise")
+        print(f"📌 Updated '{source_table}' in place with column 'dbscan_outlier'")
+
+        # 5) Copy only the non-outliers to taxi_input_model_dbscan (same columns as the IQR output)
+        columns = ", ".join(f"[{c}]" for c in table_columns(conn, source_table) if c not in OUTLIER_COLUMNS)
+        conn.execute(f"DROP TABLE IF EXISTS {target_table}")
+        conn.execute(f"CREATE TABLE {target_table} AS SELECT {columns} FROM {source_table} WHERE 0")
+        inliers = conn.execute(
+            f"INSERT INTO {target_table} SELECT {columns} FROM {source_table} WHERE dbscan_outlier = 'NO'"
+        ).rowcount
+        print(f"🚕 Exported {inliers} rows to '{target_table}'")
+
+    print(f"⏱️ DBSCAN stage finished in {time.perf_counter() - start:.1f}s")
+
+    # 6) The rebuilt table has new rowids: rebuild the demand features of everything read from it
+    invalidate_tables(conn, [target_table])
+
+    # 7) Mirror both tables to Parquet when that backend is in use
+    if STORAGE_BACKEND == "parquet":
+        export_table(conn, source_table)
+        export_table(conn, target_table)
+
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
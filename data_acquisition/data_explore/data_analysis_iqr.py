@@ -1,69 +1,120 @@
-import sqlite3
+import sys
+import time
 import pandas as pd
 import numpy as np
 from pathlib import Path
 
-def find_database_with_table(starting_path: Path, db_name: str, table_name: str) -> Path:
-    """
-    Look for all files named db_name under starting_path.
-    Return the first one whose sqlite_master lists table_name.
-    """
-    for candidate in starting_path.rglob(db_name):
-        try:
-            conn = sqlite3.connect(candidate)
-            tables = pd.read_sql_query(
-                "SELECT name FROM sqlite_master WHERE type='table';",
-                conn
-            )['name'].tolist()
-            conn.close()
-            if table_name in tables:
-                return candidate
-        except Exception:
-            # skip files that aren't valid SQLite dbs
-            continue
-    raise FileNotFoundError(
-        f"No '{db_name}' under {starting_path} contains table '{table_name}'"
-    )
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.data_access import connect, resolve_db_path, table_columns
+from common.db_maintenance import bulk_load
+from common.feature_store import invalidate_tables
+from common.quantile_sketch import QuantileSketch
+from common.trip_store import STORAGE_BACKEND, export_table
+
+source_table = "taxi_input_model_unrestricted"
+target_table = "taxi_input_model_iqr"
+chunk_size   = 500_000
+quantile_method = "sketch"  # "exact" holds the full Lat/Lon/distance arrays to compute exact quantiles
+sketch_eps   = 1e-4         # rank error bound of the quantile sketches
+# rows with a usable position; anything else is left unflagged (NULL) and excluded
+valid_coords = "typeof(Lat) IN ('real', 'integer') AND typeof(Lon) IN ('real', 'integer')"
 
 # 1) Locate the DB that has our table
-base_dir = Path(__file__).resolve().parent.parent
-db_path  = find_database_with_table(base_dir, "data_consolidated.db", "taxi_input_model_unrestricted")
+db_path = resolve_db_path(source_table)
 print(f"▶ Using database: {db_path}")
+conn = connect(db_path)
+start = time.perf_counter()
+
+def coordinate_chunks():
+    """Stream only Lat/Lon of the valid rows, chunk_size rows at a time."""
+    query = f"SELECT Lat, Lon FROM {source_table} WHERE {valid_coords}"
+    for chunk in pd.read_sql_query(query, conn, chunksize=chunk_size):
+        yield chunk["Lat"].to_numpy(), chunk["Lon"].to_numpy()
+
 
-# 2) Connect & load the table
-conn = sqlite3.connect(db_path)
-df = pd.read_sql_query("SELECT * FROM taxi_input_model_unrestricted", conn)
-print(f"✅ Loaded {len(df)} rows from taxi_input_model_unrestricted")
+if quantile_method == "sketch":
+    # 2) + 3) Median location from one streaming pass with fixed-size sketches
+    lat_sketch, lon_sketch = QuantileSketch(sketch_eps), QuantileSketch(sketch_eps)
+    for lat, lon in coordinate_chunks():
+        lat_sketch.update(lat)
+        lon_sketch.update(lon)
+    n_rows = lat_sketch.count
+    lat_med, lon_med = lat_sketch.median(), lon_sketch.median()
 
-# 3) Ensure Lat/Lon numeric & drop invalid
-df["Lat"] = pd.to_numeric(df["Lat"], errors="coerce")
-df["Lon"] = pd.to_numeric(df["Lon"], errors="coerce")
-df = df.dropna(subset=["Lat", "Lon"]).copy()
+    # 4) IQR bounds from a second pass over the distances to that median
+    dist_sketch = QuantileSketch(sketch_eps)
+    for lat, lon in coordinate_chunks():
+        dist_sketch.update(np.sqrt((lat - lat_med)**2 + (lon - lon_med)**2))
+    q1, q3 = dist_sketch.quantiles([0.25, 0.75])
+    print(f"✅ Sketched {n_rows} coordinates from {source_table} (eps={sketch_eps}, "
+          f"{lat_sketch.size + lon_sketch.size + dist_sketch.size} values retained) "
+          f"in {time.perf_counter() - start:.1f}s")
+else:
+    # 2) Exact path: stream Lat/Lon in chunks into two preallocated float arrays
+    n_rows = conn.execute(f"SELECT COUNT(*) FROM {source_table} WHERE {valid_coords}").fetchone()[0]
+    lat = np.empty(n_rows)
+    lon = np.empty(n_rows)
+    pos = 0
+    for lat_chunk, lon_chunk in coordinate_chunks():
+        lat[pos:pos + len(lat_chunk)] = lat_chunk
+        lon[pos:pos + len(lon_chunk)] = lon_chunk
+        pos += len(lat_chunk)
+    print(f"✅ Read {n_rows} coordinates from {source_table} ({(lat.nbytes + lon.nbytes) / 1e6:.0f} MB) "
+          f"in {time.perf_counter() - start:.1f}s")
 
-# 4) Compute median location & distance
-lat_med = df["Lat"].median()
-lon_med = df["Lon"].median()
-df["distance_to_med"] = np.sqrt((df["Lat"] - lat_med)**2 + (df["Lon"] - lon_med)**2)
+    # 3) Compute median location & distance, vectorized chunk by chunk
+    lat_med = np.median(lat)
+    lon_med = np.median(lon)
+    distance_to_med = np.empty(n_rows)
+    for i in range(0, n_rows, chunk_size):
+        sl = slice(i, i + chunk_size)
+        distance_to_med[sl] = np.sqrt((lat[sl] - lat_med)**2 + (lon[sl] - lon_med)**2)
+    del lat, lon
+
+    # 4) Exact quartiles of the distance
+    q1, q3 = np.quantile(distance_to_med, [0.25, 0.75])
+    del distance_to_med
 
-# 5) Compute IQR bounds
-q1 = df["distance_to_med"].quantile(0.25)
-q3 = df["distance_to_med"].quantile(0.75)
 iqr = q3 - q1
 lower, upper = q1 - 1.5*iqr, q3 + 1.5*iqr
+print(f"📐 Median ({lat_med:.6f}, {lon_med:.6f}); distance bounds [{lower:.6f}, {upper:.6f}] ({quantile_method})")
+
+with bulk_load(conn, [source_table, target_table], drop_existing_indexes=False):
+    # 5) Flag outliers in place in column 'iqr_outlier' with one set-based UPDATE.
+    #    Distances and bounds are compared squared (both sides non-negative), so no sqrt is needed in SQL.
+    if "iqr_outlier" not in table_columns(conn, source_table):
+        conn.execute(f"ALTER TABLE {source_table} ADD COLUMN iqr_outlier TEXT")
+    conn.execute(f"""
+        UPDATE {source_table}
+        SET iqr_outlier = CASE
+            WHEN NOT ({valid_coords}) THEN NULL
+            WHEN (Lat - :lat_med) * (Lat - :lat_med) + (Lon - :lon_med) * (Lon - :lon_med) > :upper_sq
+              OR (:lower >= 0 AND (Lat - :lat_med) * (Lat - :lat_med) + (Lon - :lon_med) * (Lon - :lon_med) < :lower_sq)
+            THEN 'YES' ELSE 'NO'
+        END
+    """, {"lat_med": lat_med, "lon_med": lon_med, "lower": lower,
+          "lower_sq": lower**2, "upper_sq": upper**2})
+    print(f"📌 Updated '{source_table}' in place with column 'iqr_outlier'")
+
+    # 6) Copy only the non-outliers to taxi_input_model_iqr with a single INSERT ... SELECT
+    # (flag columns of the outlier stages are not copied; the DBSCAN stage adds 'dbscan_outlier')
+    columns = ", ".join(f"[{c}]" for c in table_columns(conn, source_table) if c not in ("iqr_outlier", "dbscan_outlier"))
+    conn.execute(f"DROP TABLE IF EXISTS {target_table}")
+    conn.execute(f"CREATE TABLE {target_table} AS SELECT {columns} FROM {source_table} WHERE 0")
+    inliers = conn.execute(
+        f"INSERT INTO {target_table} SELECT {columns} FROM {source_table} WHERE iqr_outlier = 'NO'"
+    ).rowcount
+    print(f"🚕 Exported {inliers} rows to '{target_table}'")
 
-# 6) Flag outliers in new column 'iqr_outlier'
-df["iqr_outlier"] = df["distance_to_med"].apply(
-    lambda d: "YES" if (d < lower or d > upper) else "NO"
-)
+print(f"⏱️ IQR stage finished in {time.perf_counter() - start:.1f}s")
 
-# 7) Write updated taxi_input_model_unrestricted back (with the flag)
-to_save = df.drop(columns=["distance_to_med"])
-to_save.to_sql("taxi_input_model_unrestricted", conn, if_exists="replace", index=False)
-print("📌 Updated 'taxi_input_model_unrestricted' with new column 'iqr_outlier'")
+# 7) The rebuilt table has new rowids: rebuild the demand features of everything read from it
+# (e.g. the hash-sampled training views) on their next refresh
+invalidate_tables(conn, [target_table])
 
-# 8) Export only the non-outliers to taxi_input_model_iqr
-inliers = df[df["iqr_outlier"] == "NO"].drop(columns=["distance_to_med", "iqr_outlier"])
-inliers.to_sql("taxi_input_model_iqr", conn, if_exists="replace", index=False)
-print(f"🚕 Exported {len(inliers)} rows to 'taxi_input_model_iqr'")
+# 8) Mirror both tables to Parquet when that backend is in use
+if STORAGE_BACKEND == "parquet":
+    export_table(conn, source_table)
+    export_table(conn, target_table)
 
 conn.close()
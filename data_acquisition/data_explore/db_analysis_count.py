@@ -1,34 +1,28 @@
-import sqlite3
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
 
-def find_database(starting_path: Path, target_name: str) -> Path:
-    """
-    Recursively search the directory tree starting at starting_path for a file named target_name.
-    Returns the first match found, or raises a FileNotFoundError if not found.
-    """
-    for path in starting_path.rglob(target_name):
-        return path
-    raise FileNotFoundError(f"{target_name} not found in {starting_path}")
-
-# Instead of using the directory of the current script, use its parent directory.
-# This assumes that both data_explore and data_ingest (with data_consolidated.db)
-# are subfolders of the same parent directory.
-base_dir = Path(__file__).resolve().parent.parent
-print(f"Base directory: {base_dir}")
-
-# Search for the database file in the directory tree starting at base_dir.
-db_path = find_database(base_dir, 'data_consolidated.db')
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.data_access import connect, resolve_db_path, table_exists
+from common.quantile_sketch import QuantileSketch
+
+# Locate data_consolidated.db via the shared data-access layer.
+db_path = resolve_db_path()
 print(f"Database found at: {db_path}")
 
 # --- CONNECT TO DATABASE ---
-conn = sqlite3.connect(db_path)
+conn = connect(db_path)
 cursor = conn.cursor()
 
 # --- TABLES TO CHECK ---
 tables = ['taxi_input_model_unrestricted', 'taxi_input_model_dbscan', 'training_set_10_random']
 
+# --- STATISTICS ---
+quantile_method = "sketch"  # "exact" loads every Lat/Lon of a table into pandas
+sketch_eps = 1e-4           # rank error bound of the median
+chunk_size = 500_000
+
 # We'll collect our statistics here for the final consolidated table and chart.
 stats_dict = {}
 
@@ -37,30 +31,43 @@ for table in tables:
     print(f"\n🔍 Analyzing table: {table}")
 
     # Count rows and store the count
-    try:
-        cursor.execute(f"SELECT COUNT(*) FROM {table}")
-        count = cursor.fetchone()[0]
-        print(f"📊 Row count: {count}")
-    except sqlite3.OperationalError as e:
-        print(f"⚠️ Error accessing table '{table}': {e}")
+    if not table_exists(conn, table):
+        print(f"⚠️ Table '{table}' does not exist.")
         continue
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    count = cursor.fetchone()[0]
+    print(f"📊 Row count: {count}")
 
-    # Load data into pandas and calculate descriptive statistics.
+    # Stream Lat/Lon in chunks into fixed-size quantile sketches (min/max are exact,
+    # the median is approximate within sketch_eps in rank); "exact" loads both columns.
     try:
-        df = pd.read_sql_query(f"SELECT Lat, Lon FROM {table}", conn)
-
-        if df.empty:
-            print("⚠️ No data to analyze.")
-            continue
-
-        # Calculate descriptive statistics for latitude and longitude.
-        lat_min = df['Lat'].min()
-        lat_max = df['Lat'].max()
-        lat_median = df['Lat'].median()
-
-        lon_min = df['Lon'].min()
-        lon_max = df['Lon'].max()
-        lon_median = df['Lon'].median()
+        if quantile_method == "sketch":
+            lat_sketch, lon_sketch = QuantileSketch(sketch_eps), QuantileSketch(sketch_eps)
+            for chunk in pd.read_sql_query(f"SELECT Lat, Lon FROM {table}", conn, chunksize=chunk_size):
+                lat_sketch.update(pd.to_numeric(chunk['Lat'], errors='coerce'))
+                lon_sketch.update(pd.to_numeric(chunk['Lon'], errors='coerce'))
+
+            if not lat_sketch.count:
+                print("⚠️ No data to analyze.")
+                continue
+
+            lat_min, lat_median, lat_max = lat_sketch.quantiles([0, 0.5, 1])
+            lon_min, lon_median, lon_max = lon_sketch.quantiles([0, 0.5, 1])
+        else:
+            df = pd.read_sql_query(f"SELECT Lat, Lon FROM {table}", conn)
+
+            if df.empty:
+                print("⚠️ No data to analyze.")
+                continue
+
+            # Calculate descriptive statistics for latitude and longitude.
+            lat_min = df['Lat'].min()
+            lat_max = df['Lat'].max()
+            lat_median = df['Lat'].median()
+
+            lon_min = df['Lon'].min()
+            lon_max = df['Lon'].max()
+            lon_median = df['Lon'].median()
 
         # Print results for this table.
         print(f"🧭 Latitude   → min: {lat_min:.6f}, max: {lat_max:.6f}, median: {lat_median:.6f}")
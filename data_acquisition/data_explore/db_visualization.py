@@ -1,27 +1,17 @@
-import sqlite3
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
 
-def find_database(starting_path: Path, target_name: str) -> Path:
-    """
-    Recursively search the directory tree starting at starting_path for a file named target_name.
-    Returns the first match found or raises a FileNotFoundError if not found.
-    """
-    for path in starting_path.rglob(target_name):
-        return path
-    raise FileNotFoundError(f"{target_name} not found in {starting_path}")
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.data_access import connect, resolve_db_path
 
-# Set the base directory to the parent folder of the current script's directory.
-base_dir = Path(__file__).resolve().parent.parent
-print(f"Base directory: {base_dir}")
-
-# Search for the database file within the directory tree starting from base_dir.
-db_path = find_database(base_dir, 'data_consolidated.db')
+# Locate data_consolidated.db via the shared data-access layer.
+db_path = resolve_db_path()
 print(f"Database found at: {db_path}")
 
 # --- CONNECT TO THE DATABASE ---
-conn = sqlite3.connect(db_path)
+conn = connect(db_path)
 
 # --- LOAD DATA ---
 df_taxi_data_input = pd.read_sql_query("SELECT Lat, Lon FROM taxi_data_input", conn)
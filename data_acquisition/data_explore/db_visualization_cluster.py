@@ -1,38 +1,17 @@
 import os
-import sqlite3
+import sys
 import pandas as pd
 import matplotlib.pyplot as plt
 
-# 1) Locate your SQLite DB under the project
-project_root = os.path.expanduser("~/PycharmProjects/transport_forecasting")
-target_db_base = "data_consolidated"
-db_path = None
-
-for root, dirs, files in os.walk(project_root):
-    for fn in files:
-        name = fn.lower()
-        if target_db_base in name and name.endswith((".db", ".sqlite", ".sqlite3")):
-            try:
-                candidate = os.path.join(root, fn)
-                tmp = sqlite3.connect(candidate)
-                tmp.execute("SELECT name FROM sqlite_master LIMIT 1;")
-                tmp.close()
-                db_path = candidate
-                break
-            except sqlite3.DatabaseError:
-                continue
-    if db_path:
-        break
-
-if not db_path:
-    raise FileNotFoundError(
-        f"No valid SQLite DB named like “{target_db_base}.db/.sqlite” under {project_root}"
-    )
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from common.data_access import connect, resolve_db_path
 
+# 1) Locate the SQLite DB via the shared data-access layer
+db_path = resolve_db_path()
 print("→ Using database:", db_path)
 
 # 2) Load the cluster_coordinates table
-conn = sqlite3.connect(db_path)
+conn = connect(db_path)
 df = pd.read_sql("SELECT origin, cluster, Lat, Lon, count FROM cluster_coordinates;", conn)
 conn.close()
 
@@ -1,94 +1,294 @@
-import pandas as pd
+import sys
+import time
+import hashlib
 import sqlite3
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-import holidays
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.calendar_dim import CalendarDimension
+from common.compact_schema import compact_name, migrate_table
+from common.data_access import connect, resolve_db_path
+from common.db_maintenance import bulk_load, ensure_indexes
+from common.feature_store import invalidate_tables
+from common.trip_store import STORAGE_BACKEND, export_table
 
 # --- CONFIGURATION ---
 
 input_dir    = Path(__file__).parent / 'data_input'
-output_db    = Path(__file__).parent / 'data_consolidated.db'
+output_db    = resolve_db_path(must_exist=False)
 table_name   = 'taxi_input_model_unrestricted'
+manifest_table = 'ingest_manifest'
+incremental  = True     # only load new/changed CSVs; False drops and reloads everything
+chunk_size   = 250_000  # rows per CSV chunk; bounds peak memory regardless of file count
+holiday_country = 'US'  # calendar used for the special_day label
+compact_schema = False  # also refresh taxi_input_model_unrestricted_compact after ingest
+workers      = 1        # >1 parses CSVs in a process pool; holds up to workers+1 parsed files in memory
 
-# --- FIND CSV FILES ---
+csv_columns   = ['Date/Time', 'Lat', 'Lon', 'Base']
+table_columns = ['Date/Time', 'Lat', 'Lon', 'Base', 'source_file', 'special_day']
 
-csv_files = list(input_dir.glob('*.csv'))
-print(f'Found {len(csv_files)} CSV file(s) in: {input_dir}')
-for f in csv_files:
-    print(f' - {f.name}')
 
-if not csv_files:
-    print("⚠️ No CSV files found. Exiting.")
-    exit()
+# --- ADD "special_day" COLUMN ---
 
-# --- LOAD DATA WITH FILE SOURCE COLUMN ---
+def enrich_chunk(chunk: pd.DataFrame, source_file: str, calendar: CalendarDimension) -> pd.DataFrame:
+    """
+    Add the source_file and special_day columns to one CSV chunk and
+    return it in the column order of the target table.
+    """
+    chunk['source_file'] = source_file
+    chunk['special_day'] = calendar.label(pd.to_datetime(chunk['Date/Time']))
+    return chunk[table_columns]
 
-df_list = []
-for file in csv_files:
-    try:
-        df = pd.read_csv(file)
-        df['source_file'] = file.name  # add source info
-        df_list.append(df)
-    except Exception as e:
-        print(f"❌ Failed to read {file.name}: {e}")
 
-if not df_list:
-    print("⚠️ No valid CSV files loaded. Exiting.")
-    exit()
+# --- CREATE TABLE WITH TYPES IN SQLITE ---
 
-combined_df = pd.concat(df_list, ignore_index=True)
-print(f'\n✅ Combined {len(df_list)} files into {combined_df.shape[0]} rows.')
+def create_table(cursor: sqlite3.Cursor, drop_existing: bool):
+    # Drop table (full reload only) and create with explicit types, including special_day
+    if drop_existing:
+        cursor.execute(f'''
+            DROP TABLE IF EXISTS {table_name}
+        ''')
+        cursor.execute(f'''
+            DROP TABLE IF EXISTS {manifest_table}
+        ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            [Date/Time]   TEXT,
+            Lat           REAL,
+            Lon           REAL,
+            Base          TEXT,
+            source_file   TEXT,
+            special_day   TEXT
+        )
+    ''')
+    # one row per ingested CSV; lets incremental runs skip files already loaded
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {manifest_table} (
+            source_file   TEXT PRIMARY KEY,
+            size          INTEGER,
+            mtime         REAL,
+            sha256        TEXT,
+            row_count     INTEGER,
+            ingested_at   TEXT
+        )
+    ''')
 
-# --- ADD "special_day" COLUMN ---
 
-# parse Date/Time into datetime
-combined_df['parsed_datetime'] = pd.to_datetime(combined_df["Date/Time"])
+# --- FILE MANIFEST ---
 
-# prepare US holiday calendar
-us_holidays = holidays.US()
+def file_hash(file: Path) -> str:
+    sha = hashlib.sha256()
+    with open(file, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
 
-# function to label each date
-def label_special_day(dt):
-    date_only = dt.date()
-    if date_only in us_holidays:
-        return "Public Holiday"
-    weekday = dt.weekday()
-    if weekday == 5:
-        return "Saturday"
-    elif weekday == 6:
-        return "Sunday"
-    else:
-        return "Weekday"
 
-combined_df['special_day'] = combined_df['parsed_datetime'].apply(label_special_day)
+def check_manifest(cursor: sqlite3.Cursor, file: Path):
+    """
+    Compare file against its manifest entry.
+    Returns (status, sha256) with status 'new', 'changed' or 'unchanged'.
+    Files whose size and mtime match the manifest are not re-hashed.
+    """
+    stat = file.stat()
+    entry = cursor.execute(
+        f'SELECT size, mtime, sha256 FROM {manifest_table} WHERE source_file = ?', (file.name,)
+    ).fetchone()
+    if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+        return 'unchanged', entry[2]
 
-# drop helper column
-combined_df.drop(columns=['parsed_datetime'], inplace=True)
+    sha256 = file_hash(file)
+    if entry is None:
+        return 'new', sha256
+    if entry[2] == sha256:
+        # touched but identical content: refresh mtime so the next run skips the hash
+        cursor.execute(
+            f'UPDATE {manifest_table} SET size = ?, mtime = ? WHERE source_file = ?',
+            (stat.st_size, stat.st_mtime, file.name)
+        )
+        return 'unchanged', sha256
+    return 'changed', sha256
 
-# --- CREATE TABLE WITH TYPES IN SQLITE ---
 
-conn   = sqlite3.connect(output_db)
-cursor = conn.cursor()
-
-# Drop table if exists and create with explicit types, including special_day
-cursor.execute(f'''
-    DROP TABLE IF EXISTS {table_name}
-''')
-cursor.execute(f'''
-    CREATE TABLE {table_name} (
-        [Date/Time]   TEXT,
-        Lat           REAL,
-        Lon           REAL,
-        Base          TEXT,
-        source_file   TEXT,
-        special_day   TEXT
+def record_manifest(cursor: sqlite3.Cursor, file: Path, sha256: str, rows: int):
+    stat = file.stat()
+    cursor.execute(
+        f'''INSERT OR REPLACE INTO {manifest_table}
+            VALUES (?, ?, ?, ?, ?, datetime('now'))''',
+        (file.name, stat.st_size, stat.st_mtime, sha256, rows)
     )
-''')
-conn.commit()
 
-# --- WRITE DATA TO TABLE ---
 
-combined_df.to_sql(table_name, conn, if_exists='append', index=False)
-conn.close()
+# --- PARSE ONE CSV ---
+
+def read_file(file: Path, calendar: CalendarDimension):
+    """Yield the enriched chunks of file, chunk_size rows at a time."""
+    for chunk in pd.read_csv(file, usecols=csv_columns, chunksize=chunk_size):
+        yield enrich_chunk(chunk, file.name, calendar)
+
+
+def parse_file(file: Path, country: str):
+    """
+    Process-pool worker: parse and enrich a whole file.
+    Returns the enriched chunks, the calendar rows labelled on the way and the parse time.
+    """
+    start = time.perf_counter()
+    calendar = CalendarDimension(country)
+    chunks = list(read_file(file, calendar))
+    return chunks, calendar.calendar, time.perf_counter() - start
+
+
+# --- WRITE ONE CSV INTO THE TABLE ---
+
+def write_file(cursor: sqlite3.Cursor, file: Path, sha256: str, chunks) -> int:
+    """
+    Replace the rows of file with chunks (bulk executemany per chunk) and
+    update its manifest entry, all inside one savepoint. Returns the number of rows written.
+    """
+    column_list = ', '.join(f'[{c}]' for c in table_columns)
+    insert_sql  = f"INSERT INTO {table_name} ({column_list}) VALUES ({', '.join('?' * len(table_columns))})"
+
+    cursor.execute('SAVEPOINT ingest_file')
+    try:
+        # also run for 'new' files so tables loaded before the manifest existed are not duplicated
+        cursor.execute(f'DELETE FROM {table_name} WHERE source_file = ?', (file.name,))
+        rows = 0
+        for chunk in chunks:
+            cursor.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+            rows += len(chunk)
+        record_manifest(cursor, file, sha256, rows)
+    except Exception:
+        cursor.execute('ROLLBACK TO ingest_file')
+        cursor.execute('RELEASE ingest_file')
+        raise
+    cursor.execute('RELEASE ingest_file')
+    return rows
+
+
+# --- SERIAL / PARALLEL INGEST ---
+
+def ingest_serial(cursor: sqlite3.Cursor, pending: list, calendar: CalendarDimension):
+    """Stream each pending file straight from the CSV reader into SQLite."""
+    for file, status, sha256 in pending:
+        start = time.perf_counter()
+        try:
+            rows = write_file(cursor, file, sha256, read_file(file, calendar))
+        except Exception as e:
+            print(f"❌ Failed to read {file.name}: {e}")
+            continue
+        yield file, status, rows, time.perf_counter() - start
+
+
+def ingest_parallel(cursor: sqlite3.Cursor, pending: list, calendar: CalendarDimension):
+    """
+    Parse pending files in a pool of `workers` processes while this process
+    stays the only SQLite writer. Files are written in submission order and
+    only `workers` files are queued ahead of the writer.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        todo  = iter(pending)
+        queue = deque(
+            (file, status, sha256, pool.submit(parse_file, file, holiday_country))
+            for file, status, sha256 in islice(todo, workers)
+        )
+        while queue:
+            file, status, sha256, future = queue.popleft()
+            for nxt_file, nxt_status, nxt_sha256 in islice(todo, 1):
+                queue.append((nxt_file, nxt_status, nxt_sha256, pool.submit(parse_file, nxt_file, holiday_country)))
+
+            try:
+                chunks, labelled, parse_time = future.result()
+                start = time.perf_counter()
+                rows = write_file(cursor, file, sha256, chunks)
+            except Exception as e:
+                print(f"❌ Failed to read {file.name}: {e}")
+                continue
+            calendar.merge(labelled)
+            yield file, status, rows, parse_time + time.perf_counter() - start
+
+
+def main():
+    # --- FIND CSV FILES ---
+
+    csv_files = sorted(input_dir.glob('*.csv'))
+    print(f'Found {len(csv_files)} CSV file(s) in: {input_dir}')
+    for f in csv_files:
+        print(f' - {f.name}')
+
+    if not csv_files:
+        print("⚠️ No CSV files found. Exiting.")
+        return
+
+    # --- LOAD DATA WITH FILE SOURCE COLUMN ---
+
+    # isolation_level=None lets us manage the single explicit transaction ourselves;
+    # each file gets a savepoint so a broken CSV does not leave partial rows behind.
+    conn   = connect(output_db, isolation_level=None)
+    cursor = conn.cursor()
+    # a full reload recreates the table without indexes anyway; incremental runs keep
+    # theirs because the per-file DELETE relies on the source_file index
+    with bulk_load(conn, [table_name], drop_existing_indexes=False):
+        cursor.execute('BEGIN')
+        create_table(cursor, drop_existing=not incremental)
+        calendar = CalendarDimension.from_sql(conn, holiday_country)
+
+        pending = []
+        for file in csv_files:
+            status, sha256 = check_manifest(cursor, file)
+            if status == 'unchanged':
+                print(f' ⏭️ {file.name}: unchanged, skipped')
+                continue
+            pending.append((file, status, sha256))
+
+        ingest = ingest_parallel if workers > 1 and len(pending) > 1 else ingest_serial
+
+        loaded_files = 0
+        changed_files = 0
+        total_rows   = 0
+        wall_start   = time.perf_counter()
+        for file, status, rows, elapsed in ingest(cursor, pending, calendar):
+            loaded_files += 1
+            changed_files += status == 'changed'
+            total_rows   += rows
+            print(f' ✅ {file.name} ({status}): {rows} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/s)')
+        wall_time = time.perf_counter() - wall_start
+
+        if loaded_files:
+            # share the labelled dates with the trainers via the calendar_dim table
+            calendar.to_sql(conn)
+            cursor.execute('COMMIT')
+        elif incremental:
+            # nothing loaded: commit only to keep the manifest mtime refreshes
+            cursor.execute('COMMIT')
+        else:
+            # a full reload without a single loaded file would leave an empty table: keep the old one
+            cursor.execute('ROLLBACK')
+
+    if not loaded_files:
+        conn.close()
+        print("⚠️ No new or changed CSV files loaded. Exiting.")
+        return
+
+    # a reload or a changed file deleted trips: demand features built on the table are rebuilt
+    if changed_files or not incremental:
+        invalidate_tables(conn, [table_name])
+    if compact_schema:
+        migrate_table(conn, table_name)
+        ensure_indexes(conn, [compact_name(table_name)])
+    if STORAGE_BACKEND == 'parquet':
+        export_table(conn, table_name)
+    conn.close()
+
+    print(f'\n✅ Streamed {loaded_files} new/changed files into {total_rows} rows '
+          f'in {wall_time:.1f}s ({total_rows / max(wall_time, 1e-9):,.0f} rows/s, workers={workers}).')
+    print(f'\n📦 Data written to database: {output_db}')
+    print(f'    Table: "{table_name}" with columns Date/Time, Lat, Lon, Base, source_file, special_day.')
+
 
-print(f'\n📦 Data written to database: {output_db}')
-print(f'    Table: "{table_name}" with columns Date/Time, Lat, Lon, Base, source_file, special_day.')
+if __name__ == '__main__':
+    main()
@@ -1,26 +1,15 @@
-import sqlite3
+import sys
 from pathlib import Path
 
-def find_database(starting_path: Path, target_name: str) -> Path:
-    """
-    Recursively search the directory tree starting at starting_path for a file
-    named target_name. Returns the path to the first match found, or raises a
-    FileNotFoundError if not found.
-    """
-    for path in starting_path.rglob(target_name):
-        return path
-    raise FileNotFoundError(f"{target_name} not found in {starting_path}")
+sys.path.append(str(Path(__file__).resolve().parents[3]))
+from common.data_access import connect, resolve_db_path
 
-# Set the base directory to the parent folder of the current script
-base_dir = Path(__file__).resolve().parent.parent
-print(f"Base directory: {base_dir}")
-
-# Locate the database file 'data_consolidated.db' in the project
-db_path = find_database(base_dir, 'data_consolidated.db')
+# Locate the database file 'data_consolidated.db' via the shared data-access layer
+db_path = resolve_db_path()
 print(f"Database found at: {db_path}")
 
 # Connect to the database
-conn = sqlite3.connect(db_path)
+conn = connect(db_path)
 cursor = conn.cursor()
 
 # SQL command to drop (delete) the table "taxi_input_model_dbscan""
@@ -0,0 +1,62 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.data_access import connect, list_tables, resolve_db_path, table_columns
+from common.db_maintenance import TRIP_TABLES, drop_indexes, ensure_indexes, time_query
+
+# --- CONFIGURATION ---
+
+db_path = resolve_db_path()
+print(f"Using database: {db_path}")
+
+conn = connect(db_path)
+present = list_tables(conn)
+tables = [t for base in TRIP_TABLES for t in (base, f"{base}_compact") if t in present]
+
+
+def benchmark_queries(table: str) -> dict:
+    """Time the query shapes the pipeline runs against table."""
+    columns = set(table_columns(conn, table))
+    timings = {}
+    if 'cluster' in columns:
+        timings['group_by_cluster'] = time_query(conn, f"SELECT cluster, COUNT(*) FROM {table} GROUP BY cluster")
+    if 'source_file' in columns:
+        timings['source_file_lookup'] = time_query(
+            conn, f"SELECT COUNT(*) FROM {table} WHERE source_file = (SELECT MAX(source_file) FROM {table})"
+        )
+    if 'ts' in columns:
+        timings['ts_range'] = time_query(
+            conn, f"SELECT COUNT(*) FROM {table} WHERE ts >= (SELECT MAX(ts) - 86400 FROM {table})"
+        )
+    return timings
+
+
+# --- BEFORE: NO SECONDARY INDEXES ---
+
+before = {}
+for table in tables:
+    drop_indexes(conn, table)
+conn.commit()
+for table in tables:
+    before[table] = benchmark_queries(table)
+
+# --- CREATE + ANALYZE DECLARED INDEXES ---
+
+ensure_indexes(conn, tables)
+
+# --- AFTER ---
+
+rows = []
+for table in tables:
+    after = benchmark_queries(table)
+    for query, seconds in after.items():
+        rows.append({'table': table, 'query': query,
+                     'before_s': before[table][query], 'after_s': seconds})
+
+conn.close()
+
+print("\n===== QUERY TIMINGS BEFORE / AFTER INDEXING =====")
+print(pd.DataFrame(rows).round(4).to_string(index=False))
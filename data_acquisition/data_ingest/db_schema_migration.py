@@ -0,0 +1,66 @@
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.append(str(Path(__file__).resolve().parents[2]))
+from common.compact_schema import migrate_table, read_compact, table_bytes, compact_name
+from common.data_access import connect, resolve_db_path, table_exists
+
+# --- CONFIGURATION ---
+
+db_path = resolve_db_path()
+tables  = [
+    'taxi_input_model_unrestricted',
+    'taxi_input_model_iqr',
+    'training_set_10_random_blue',
+    'training_set_5_random_blue',
+]
+
+print(f"Using database: {db_path}")
+
+conn = connect(db_path)
+# the hash-sampled training sets are views: they become views over the compact tables
+existing = {t for t in tables if table_exists(conn, t)}
+
+# --- MIGRATE EACH TABLE TO THE COMPACT SCHEMA ---
+
+for table in tables:
+    if table not in existing:
+        print(f"⚠️ Table '{table}' not found, skipped.")
+        continue
+    migrate_table(conn, table)
+
+# --- COMPARE SIZE, LOAD AND FEATURE-ENGINEERING TIME ---
+
+rows = []
+for table in tables:
+    if table not in existing:
+        continue
+
+    start = time.perf_counter()
+    df = pd.read_sql_query(f"SELECT [Date/Time] FROM {table}", conn)
+    load_text = time.perf_counter() - start
+    start = time.perf_counter()
+    parsed = pd.to_datetime(df['Date/Time'])
+    day, hour = parsed.dt.day, parsed.dt.hour
+    features_text = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df = read_compact(conn, table, ['day', 'hour'])
+    load_compact = time.perf_counter() - start
+
+    rows.append({
+        'table': table,
+        'MB_text': (table_bytes(conn, table) or 0) / 1e6,
+        'MB_compact': (table_bytes(conn, compact_name(table)) or 0) / 1e6,
+        'load_s_text': load_text,
+        'features_s_text': features_text,
+        'load_and_features_s_compact': load_compact,
+    })
+
+conn.close()
+
+print("\n===== TEXT VS COMPACT SCHEMA =====")
+print(pd.DataFrame(rows).round(3).to_string(index=False))
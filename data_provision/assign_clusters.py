@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.cluster_model import CentroidModel
+from common.compact_schema import compact_name
+from common.data_access import connect, resolve_db_path, table_columns, table_exists
+from common.db_maintenance import bulk_load
+from common.feature_store import refresh_all_features
+from common.trip_store import STORAGE_BACKEND, export_table
+
+# Labels trips with the persisted centroids of cluster_simulation.py instead of
+# re-fitting KMeans, e.g. after a new month was appended by the ingest.
+
+# 1) Configuration
+tables = [
+    "taxi_input_model_unrestricted",
+    "taxi_input_model_iqr"
+]
+model_version = None   # None = latest centroids_v*.json
+only_unlabelled = True  # False re-labels every row with this model version
+
+# 2) Load the centroid model & locate the SQLite DB
+model = CentroidModel.load(model_version)
+print(f"→ Centroid model v{model.version} ({model.n_clusters} clusters, "
+      f"fitted on {model.meta.get('fitted_on')} at {model.meta.get('created')})")
+
+# a grid-fitted model labels by grid cell like cluster_simulation.py, per trip otherwise
+grid_deg = model.meta.get("grid_deg")
+print(f"→ Labelling {'per grid cell of ' + str(grid_deg) + '°' if grid_deg else 'per trip'}")
+
+db_path = resolve_db_path("taxi_input_model_unrestricted")
+print("→ Using database:", db_path)
+conn = connect(db_path)
+
+# 3) Nearest-centroid labels for each table, written with set-based UPDATEs;
+#    compact copies (TRIP_SCHEMA=compact) are labelled the same way, not derived from the tables
+labelled = tables + [compact_name(t) for t in tables if table_exists(conn, compact_name(t))]
+with bulk_load(conn, labelled, drop_existing_indexes=not only_unlabelled):
+    for tbl in labelled:
+        if "cluster" not in table_columns(conn, tbl):
+            conn.execute(f"ALTER TABLE {tbl} ADD COLUMN cluster INTEGER;")
+
+        start = time.perf_counter()
+        cent, _ = model.label_table(conn, tbl, where="cluster IS NULL" if only_unlabelled else "",
+                                    grid_deg=grid_deg)
+        print(f"✅ {tbl}: {cent['count'].sum()} trips labelled in {time.perf_counter() - start:.1f}s")
+
+# 4) Add the newly labelled trips to the demand feature store (only rows after each watermark)
+refresh_all_features(conn, full=not only_unlabelled)
+
+# 5) Re-export the clustered tables when the Parquet backend is in use & close
+if STORAGE_BACKEND == "parquet":
+    for tbl in tables:
+        export_table(conn, tbl)
+conn.close()
@@ -1,13 +1,16 @@
-import sqlite3
+import sys
 import pandas as pd
 from pathlib import Path
 
-# Define the path to the SQLite database
-db_path = r"/data_acquisition\data_ingest\data_consolidated.db"
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common.data_access import connect, resolve_db_path
+
+# Locate the SQLite database that holds the training table
 table_name = "training_set_10_random_blue"
+db_path = resolve_db_path(table_name)
 
 # 🔌 Connect to the SQLite database
-conn = sqlite3.connect(db_path)
+conn = connect(db_path)
 
 # 🧮 SQL query: Count number of rows per cluster
 query = f"""
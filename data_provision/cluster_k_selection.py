@@ -0,0 +1,110 @@
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from threadpoolctl import threadpool_limits
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.cluster_model import grid_cells
+from common.data_access import connect, resolve_db_path
+
+# Re-derives the number of clusters on the current data: every candidate K is
+# fitted (weighted KMeans on grid cells, as fit_method = "grid" in
+# cluster_simulation.py) in its own process and scored by inertia and by the
+# silhouette of a fixed random sample of trips (exact silhouette is quadratic).
+
+# --- CONFIGURATION ---
+
+fit_table = "taxi_input_model_iqr"
+result_table = "cluster_k_selection"
+k_values = range(4, 17)
+grid_deg = 0.001
+silhouette_sample = 10_000  # trips scored per K; the same sample is used for every K
+workers = 4
+random_state = 42
+
+
+_LIMITS = {}
+
+
+def _init_worker(threads: int):
+    """Cap the OpenMP/BLAS threads of a worker so workers x threads does not oversubscribe the cores."""
+    _LIMITS["limits"] = threadpool_limits(threads)
+
+
+def evaluate_k(k: int, cells: np.ndarray, weights: np.ndarray, sample: np.ndarray) -> dict:
+    """Fit K on the weighted cells; inertia over the cells, silhouette on the trip sample."""
+    start = time.perf_counter()
+    km = KMeans(n_clusters=k, random_state=random_state).fit(cells, sample_weight=weights)
+    fit_time = time.perf_counter() - start
+    labels = km.predict(sample)
+    return {
+        "k": k,
+        "inertia": km.inertia_,
+        "silhouette": silhouette_score(sample, labels) if len(set(labels)) > 1 else np.nan,
+        "n_iter": km.n_iter_,
+        "fit_s": fit_time,
+        "total_s": time.perf_counter() - start,
+    }
+
+
+def sample_trips(conn, n: int) -> np.ndarray:
+    """Random sample of n trips of fit_table, drawn by rowid (no full-table sort)."""
+    max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {fit_table}").fetchone()[0] or 0
+    rowids = np.random.default_rng(random_state).choice(max_rowid, size=min(n, max_rowid), replace=False) + 1
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS k_sample (id INTEGER PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.k_sample")
+    conn.executemany("INSERT INTO temp.k_sample VALUES (?)", ((int(r),) for r in rowids))
+    sample = pd.read_sql_query(
+        f"SELECT Lat, Lon FROM {fit_table} WHERE rowid IN (SELECT id FROM temp.k_sample)", conn
+    )
+    conn.execute("DROP TABLE temp.k_sample")
+    return sample.to_numpy(float)
+
+
+def main():
+    # 1) Locate the DB, aggregate fit_table onto the grid and draw the silhouette sample
+    db_path = resolve_db_path(fit_table)
+    print("→ Using database:", db_path)
+    conn = connect(db_path)
+
+    start = time.perf_counter()
+    cells = grid_cells(conn, fit_table, grid_deg)
+    sample = sample_trips(conn, silhouette_sample)
+    coords, weights = cells[["Lat", "Lon"]].to_numpy(float), cells["n"].to_numpy(float)
+    # spread of the trips around their cell means; adding it makes the cell inertia exact per trip
+    spread = float(np.maximum(cells["lat_sq"] + cells["lon_sq"] - weights * (coords ** 2).sum(axis=1), 0).sum())
+    print(f"→ {int(weights.sum())} trips in {len(cells)} cells of {grid_deg}°, "
+          f"{len(sample)} sampled trips ({time.perf_counter() - start:.1f}s)")
+
+    # 2) Fit & score the candidate K values in parallel
+    start = time.perf_counter()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = [pool.submit(evaluate_k, k, coords, weights, sample) for k in k_values]
+        results = pd.DataFrame([f.result() for f in futures])
+    results["inertia"] += spread
+    results["inertia_drop"] = -results["inertia"].pct_change()
+    print(f"→ Evaluated {len(results)} K values in {time.perf_counter() - start:.1f}s "
+          f"(workers={workers}, threads per worker={threads})")
+
+    # 3) Write the comparison table
+    results.insert(0, "fit_table", fit_table)
+    results.insert(1, "created", pd.Timestamp.now().isoformat(timespec="seconds"))
+    results.to_sql(result_table, conn, if_exists="replace", index=False)
+    conn.close()
+
+    print("\n===== K SELECTION =====")
+    print(results[["k", "inertia", "inertia_drop", "silhouette", "n_iter", "fit_s"]].round(4).to_string(index=False))
+    best = results.loc[results["silhouette"].idxmax()]
+    print(f"\n✅ Best silhouette at K={int(best['k'])} ({best['silhouette']:.4f}); "
+          f"results written to table '{result_table}'.")
+
+
+if __name__ == "__main__":
+    main()
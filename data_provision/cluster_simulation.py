@@ -1,44 +1,44 @@
 import os
-import sqlite3
+import sys
+import time
+import numpy as np
 import pandas as pd
 from sklearn.cluster import KMeans
 
-# 1) Project root (no hard‑coded “C:”)
-project_root = os.path.expanduser("~/PycharmProjects/transport_forecasting")
-
-# 2) Locate the correct SQLite DB file
-target_db_base = "data_consolidated"
-db_path = None
-for root, dirs, files in os.walk(project_root):
-    for fn in files:
-        name = fn.lower()
-        if target_db_base in name and name.endswith((".db", ".sqlite", ".sqlite3")):
-            candidate = os.path.join(root, fn)
-            try:
-                tmp = sqlite3.connect(candidate)
-                tmp.execute("SELECT name FROM sqlite_master LIMIT 1;")
-                tmp.close()
-                db_path = candidate
-                break
-            except sqlite3.DatabaseError:
-                continue
-    if db_path:
-        break
-
-if not db_path:
-    raise FileNotFoundError(
-        f"Could not find a valid SQLite DB named like “{target_db_base}.db/.sqlite” under {project_root}"
-    )
-
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.cluster_model import (CentroidModel, centroid_shift_m, fit_grid, fit_minibatch, init_params,
+                                  match_clusters, model_versions)
+from common.compact_schema import compact_name
+from common.data_access import connect, resolve_db_path, table_columns, table_exists
+from common.db_maintenance import bulk_load
+from common.feature_store import invalidate_features
+from common.trip_store import STORAGE_BACKEND, export_table
+
+# 1) + 2) Locate the SQLite DB via the shared data-access layer
+db_path = resolve_db_path("taxi_input_model_iqr")
 print("→ Using database:", db_path)
 
-# 3) Define the tables to cluster
+# 3) Define the tables to cluster; one fit on fit_table labels all of them
 tables = [
     "taxi_input_model_unrestricted",
     "taxi_input_model_iqr"
 ]
-
-conn = sqlite3.connect(db_path)
+fit_table = "taxi_input_model_iqr"
+
+# Clustering mode: "full" loads fit_table and runs full-batch KMeans;
+# "minibatch" streams chunk_size rows at a time (partial_fit, then a labelling pass);
+# "grid" bins trips onto grid_deg cells in SQL and runs KMeans on the cells weighted by trip count
+fit_method = "minibatch"
+n_clusters = 10
+chunk_size = 500_000
+minibatch_epochs = 2
+grid_deg = 0.001
+# Start from the latest saved centroids and keep their cluster IDs, so re-clustering after a
+# monthly append converges quickly and TaxiDemandCluster_{id} models stay attached to their area
+warm_start = True
+compare_full_batch = False  # also fit full-batch KMeans to report its inertia (loads the table)
+
+conn = connect(db_path)
 cur = conn.cursor()
 
 # 4) Ensure cluster_coordinates table exists (clear any existing entries)
@@ -54,44 +54,90 @@ CREATE TABLE IF NOT EXISTS cluster_coordinates (
 cur.execute("DELETE FROM cluster_coordinates;")
 
 all_centroids = []
-
-# 5) Process each table in turn
-for tbl in tables:
-    print(f"→ Processing table: {tbl}")
-
-    # 5a) Add 'cluster' column if missing
-    cur.execute(f"PRAGMA table_info({tbl});")
-    cols = [c[1] for c in cur.fetchall()]
-    if "cluster" not in cols:
-        cur.execute(f"ALTER TABLE {tbl} ADD COLUMN cluster INTEGER;")
-
-    # 5b) Load data
-    df = pd.read_sql(f"SELECT rowid, Lat, Lon FROM {tbl};", conn)
-
-    # 5c) Run KMeans(n=10)
-    coords = df[["Lat", "Lon"]]
-    km = KMeans(n_clusters=10, random_state=42)
-    df["cluster"] = km.fit_predict(coords) + 1  # labels 1–10
-
-    # 5d) Write back cluster labels
-    for _, row in df.iterrows():
-        cur.execute(
-            f"UPDATE {tbl} SET cluster = ? WHERE rowid = ?;",
-            (int(row["cluster"]), int(row["rowid"]))
-        )
-
-    # 5e) Compute centroids & counts, collect for insertion
-    cent = (
-        df.groupby("cluster")
-          .agg(count=("rowid", "size"),
-               Lat=("Lat", "mean"),
-               Lon=("Lon", "mean"))
-          .reset_index()
+inertias = {}
+
+# 5) Warm start: initialise from the latest persisted centroids (if any, with the same K)
+previous = None
+if warm_start and model_versions():
+    previous = CentroidModel.load()
+    if previous.n_clusters != n_clusters:
+        print(f"⚠️ Latest centroid model v{previous.version} has {previous.n_clusters} clusters – fitting from scratch")
+        previous = None
+init = previous.centers if previous else None
+
+# 5a) Fit the centroids once on fit_table
+start = time.perf_counter()
+if fit_method == "minibatch":
+    # stream Lat/Lon in chunks into MiniBatchKMeans (bounded memory)
+    km = fit_minibatch(conn, fit_table, n_clusters=n_clusters, epochs=minibatch_epochs,
+                       chunk_size=chunk_size, init=init)
+elif fit_method == "grid":
+    # weighted KMeans on the occupied grid cells (cost depends on cells, not trips)
+    km = fit_grid(conn, fit_table, n_clusters=n_clusters, grid_deg=grid_deg, init=init)
+else:
+    # load the coordinates and run full-batch KMeans(n=10)
+    km = KMeans(n_clusters=n_clusters, random_state=42, **init_params(init)).fit(
+        pd.read_sql(f"SELECT Lat, Lon FROM {fit_table};", conn)
     )
-    cent["origin"] = tbl
-    all_centroids.append(cent[["origin", "cluster", "Lat", "Lon", "count"]])
-
-# 6) Concatenate all centroids and insert into cluster_coordinates
+iterations = f", {km.n_iter_} iterations" if hasattr(km, "n_iter_") else ""
+print(f"→ Fitted {fit_method} KMeans on {fit_table} in {time.perf_counter() - start:.1f}s{iterations}"
+      + (f" (warm start from v{previous.version})" if previous else ""))
+
+# 5b) Keep the cluster IDs of the previous model: match new to old centres (minimum-cost assignment)
+centers = km.cluster_centers_
+model = CentroidModel(centers, {"fitted_on": fit_table, "method": fit_method, "n_clusters": n_clusters})
+if fit_method == "grid":
+    model.meta["grid_deg"] = grid_deg
+if previous:
+    model.centers = centers[match_clusters(centers, previous.centers)]
+    shift = centroid_shift_m(model.centers, previous.centers)
+    model.meta["warm_start_from"] = previous.version
+    model.meta["centroid_shift_m"] = shift.round(1).tolist()
+    print(f"→ Matched cluster IDs to v{previous.version}: centroid shift median {np.median(shift):.0f} m, "
+          f"max {shift.max():.0f} m (cluster {shift.argmax() + 1})")
+
+# 6) Label every table from that one fit: nearest centroid chunk by chunk, set-based UPDATEs
+# (bulk-load mode: relaxed journaling, cluster indexes dropped during the write-back);
+# compact copies (TRIP_SCHEMA=compact) get the same labels, they are not derived from the tables
+compact_tables = [compact_name(t) for t in tables if table_exists(conn, compact_name(t))]
+with bulk_load(conn, tables + compact_tables):
+    for tbl in tables:
+        print(f"→ Labelling table: {tbl}")
+
+        # 6a) Add 'cluster' column if missing
+        if "cluster" not in table_columns(conn, tbl):
+            cur.execute(f"ALTER TABLE {tbl} ADD COLUMN cluster INTEGER;")
+
+        # 6b) Assign labels 1–10 and collect centroids & counts of the assigned trips
+        start = time.perf_counter()
+        #     (grid mode: per cell, mapped back to the trips by a join on the cell key)
+        cent, inertias[tbl] = model.label_table(conn, tbl, chunk_size=chunk_size,
+                                                grid_deg=grid_deg if fit_method == "grid" else None)
+        print(f"   inertia {inertias[tbl]:.4f}, labelled in {time.perf_counter() - start:.1f}s")
+
+        cent["origin"] = tbl
+        all_centroids.append(cent[["origin", "cluster", "Lat", "Lon", "count"]])
+
+    for tbl in compact_tables:
+        if "cluster" not in table_columns(conn, tbl):
+            cur.execute(f"ALTER TABLE {tbl} ADD COLUMN cluster INTEGER;")
+        model.label_table(conn, tbl, chunk_size=chunk_size, grid_deg=grid_deg if fit_method == "grid" else None)
+        print(f"→ Labelled compact copy: {tbl}")
+
+# 6c) Optional quality check of the minibatch/grid fit against full-batch KMeans
+#     (loads the whole fit table, so only meant for benchmarking)
+if fit_method != "full" and compare_full_batch:
+    start = time.perf_counter()
+    full = KMeans(n_clusters=n_clusters, random_state=42).fit(pd.read_sql(f"SELECT Lat, Lon FROM {fit_table};", conn))
+    print(f"→ full-batch KMeans on {fit_table}: inertia {full.inertia_:.4f} in {time.perf_counter() - start:.1f}s "
+          f"({fit_method} / full = {inertias[fit_table] / full.inertia_:.4f})")
+
+# 6d) Persist the centroids as the next model version; assign_clusters.py labels new trips with it
+model.meta["inertia"] = inertias
+model_path = model.save()
+print(f"💾 Saved centroid model v{model.version} to {model_path}")
+
+# 7) Concatenate all centroids and insert into cluster_coordinates
 all_centroids_df = pd.concat(all_centroids, ignore_index=True)
 
 for _, row in all_centroids_df.iterrows():
@@ -106,8 +152,13 @@ for _, row in all_centroids_df.iterrows():
         )
     )
 
-# 7) Commit & close
+# 8) Commit, re-export the now clustered tables (partitioned by month and cluster) & close;
+#    every trip may have a new label, so the demand feature store is rebuilt on its next refresh
 conn.commit()
+invalidate_features(conn)
+if STORAGE_BACKEND == "parquet":
+    for tbl in tables:
+        export_table(conn, tbl)
 conn.close()
 
-print("✅ Done: clusters assigned in all tables and cluster_coordinates populated (30 rows).")
+print(f"✅ Done: clusters assigned in all tables and cluster_coordinates populated ({len(all_centroids_df)} rows).")
@@ -0,0 +1,59 @@
+import os
+import sys
+import time
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.data_access import connect, resolve_db_path, table_columns
+from common.db_maintenance import bulk_update
+
+# Compares the old per-row cluster write-back (iterrows + one UPDATE per trip)
+# with the staged bulk_update() on the full tables. Every run is rolled back,
+# so the stored cluster labels are left untouched.
+
+# 1) Locate the SQLite DB via the shared data-access layer
+db_path = resolve_db_path("taxi_input_model_iqr")
+print("→ Using database:", db_path)
+
+tables = [
+    "taxi_input_model_unrestricted",
+    "taxi_input_model_iqr"
+]
+
+conn = connect(db_path)
+cur = conn.cursor()
+results = []
+
+for tbl in tables:
+    if "cluster" not in table_columns(conn, tbl):
+        print(f"⚠️ {tbl} has no cluster column yet – run cluster_simulation.py first.")
+        continue
+
+    # 2) Re-write the labels currently stored (same work as step 5d of cluster_simulation.py)
+    df = pd.read_sql(f"SELECT rowid, cluster FROM {tbl};", conn)
+    df["cluster"] = df["cluster"].fillna(0).astype(int)
+    print(f"→ Benchmarking {tbl} ({len(df)} rows)")
+
+    # 3) Per-row UPDATE
+    start = time.perf_counter()
+    for _, row in df.iterrows():
+        cur.execute(
+            f"UPDATE {tbl} SET cluster = ? WHERE rowid = ?;",
+            (int(row["cluster"]), int(row["rowid"]))
+        )
+    per_row = time.perf_counter() - start
+    conn.rollback()
+
+    # 4) Staged temp table + one set-based UPDATE
+    start = time.perf_counter()
+    bulk_update(conn, tbl, "cluster", df["rowid"].to_numpy(), df["cluster"].to_numpy())
+    bulk = time.perf_counter() - start
+    conn.rollback()
+
+    results.append({"table": tbl, "rows": len(df), "per_row_s": per_row,
+                    "bulk_s": bulk, "speedup": per_row / bulk})
+
+conn.close()
+
+print("\n===== CLUSTER WRITE-BACK: PER-ROW vs BULK =====")
+print(pd.DataFrame(results).round(2).to_string(index=False))
@@ -0,0 +1,53 @@
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from common.data_access import connect, resolve_db_path, table_exists
+from common.db_maintenance import ensure_indexes
+from common.feature_store import invalidate_features
+from common.sampling import assign_sample_buckets, create_sample_view, stratified_sample
+from common.trip_store import STORAGE_BACKEND, export_table
+
+# --- CONFIGURATION ---
+
+source_table = 'taxi_input_model_iqr'
+# target table -> fraction sampled from every stratum
+samples = {
+    'training_set_10_random_blue': 0.10,
+    'training_set_5_random_blue': 0.05,
+}
+# "hash": views over the source selecting a stable hash bucket range (nested, no copies);
+# "stratified": physical copies with exactly round(fraction * n) rows per stratum
+method = 'hash'
+# trips are bucketed where they enter the pipeline, so the IQR/DBSCAN outputs inherit the buckets
+bucket_tables = ['taxi_input_model_unrestricted', source_table]
+strata = ['month']  # stratified only: any of 'month', 'cluster', 'special_day'
+seed = 42
+
+# Locate the database file via the shared data-access layer.
+db_path = resolve_db_path(source_table)
+print(f"Database found at: {db_path}")
+conn = connect(db_path)
+
+if method == 'hash':
+    # Bucket new trips (only rows without a bucket), then expose each fraction as a view.
+    present = [t for t in bucket_tables if table_exists(conn, t)]
+    for table in present:
+        assign_sample_buckets(conn, table)
+    ensure_indexes(conn, present)
+    for target_table, fraction in samples.items():
+        create_sample_view(conn, source_table, target_table, fraction)
+else:
+    # Sample each training set inside SQLite: only row ids and strata are streamed into Python.
+    for target_table, fraction in samples.items():
+        stratified_sample(conn, source_table, target_table, fraction, strata=strata, seed=seed)
+
+# The training sets were redefined: their demand features are rebuilt on the next refresh.
+invalidate_features(conn, samples)
+
+if STORAGE_BACKEND == "parquet":
+    for target_table in samples:
+        export_table(conn, target_table)
+
+# Close the database connection.
+conn.close()
@@ -1,17 +1,40 @@
+import os
+import sys
+
 from flask import Flask, request, render_template
 import mlflow.pyfunc
 import pandas as pd
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.data_access import connect
+from common.feature_store import FEATURE_COLUMNS, add_calendar_features, feature_clusters
+
 # Configuration
-NUM_CLUSTERS = 10
+NUM_CLUSTERS = 10  # fallback if the demand feature store has not been built yet
+GLOBAL_MODEL_NAME = "TaxiDemandGlobal"  # one model for all clusters; per-cluster models are the fallback
 mlflow.set_tracking_uri("http://127.0.0.1:5000")  # Link to MLflow backend
 
 # Flask app
 app = Flask(__name__, template_folder='.')
 
-# Load models from MLflow registry
+# Clusters to serve = the clusters of the demand feature store the models were trained from
+try:
+    with connect() as conn:
+        cluster_ids = feature_clusters(conn)
+except FileNotFoundError:
+    cluster_ids = []
+cluster_ids = cluster_ids or list(range(1, NUM_CLUSTERS + 1))
+
+# Load models from MLflow registry: the global model if registered, else one model per cluster
+global_model = None
+try:
+    global_model = mlflow.pyfunc.load_model(f"models:/{GLOBAL_MODEL_NAME}/Production")
+    print(f"Loaded model '{GLOBAL_MODEL_NAME}' from registry.")
+except Exception as e:
+    print(f"No global model {GLOBAL_MODEL_NAME} ({e}); loading per-cluster models.")
+
 models = {}
-for cluster_id in range(1, NUM_CLUSTERS + 1):
+for cluster_id in ([] if global_model else cluster_ids):
     model_name = f"TaxiDemandCluster_{cluster_id}"
     model_uri = f"models:/{model_name}/Production"
     try:
@@ -25,6 +48,7 @@ def predict():
     result = None
     if request.method == "POST":
         try:
+            day = int(request.form.get("day", 15))
             hour = int(request.form["hour"])
             day_type = request.form["day_type"]
 
@@ -35,20 +59,25 @@ def predict():
                 "Public Holiday": 3
             }
             special_day = day_type_map.get(day_type, 0)
-            is_weekend = 1 if special_day in [1, 2] else 0
-            weekend_hour_interaction = hour * is_weekend
 
-            input_data = pd.DataFrame([{
-                "day": 15,  # Fixed placeholder or make it user-defined later
+            # same derived features as the stored training rows
+            input_data = add_calendar_features(pd.DataFrame([{
+                "day": day,
                 "hour": hour,
                 "special_day": special_day,
-                "weekend_hour_interaction": weekend_hour_interaction
-            }])
+            }]))[FEATURE_COLUMNS]
 
-            result = {
-                f"Cluster {cid}": round(model.predict(input_data)[0], 2)
-                for cid, model in models.items()
-            }
+            if global_model:
+                # one vectorized predict: one row per cluster
+                batch = input_data.loc[input_data.index.repeat(len(cluster_ids))].reset_index(drop=True)
+                batch.insert(0, "cluster", cluster_ids)
+                predictions = global_model.predict(batch)
+                result = {f"Cluster {cid}": round(float(p), 2) for cid, p in zip(cluster_ids, predictions)}
+            else:
+                result = {
+                    f"Cluster {cid}": round(model.predict(input_data)[0], 2)
+                    for cid, model in models.items()
+                }
 
         except Exception as e:
             result = {"Error": str(e)}
@@ -6,6 +6,8 @@ from mlflow.tracking import MlflowClient
 EXPERIMENT_NAME      = "Taxi_Demand_Per_Cluster"
 REGISTERED_MODEL_FMT = "TaxiDemandCluster_{cluster_id}"
 ARTIFACT_PATH_FMT    = "model_cluster_{cluster_id}"
+GLOBAL_MODEL_NAME    = "TaxiDemandGlobal"   # one model for all clusters (model_scope = "global")
+GLOBAL_ARTIFACT_PATH = "model_global"
 TARGET_STAGE         = "Production"   # or "Production"
 
 # 1. Initialize client and find experiment
@@ -22,22 +24,32 @@ runs = client.search_runs(
     order_by=["attributes.start_time DESC"]
 )
 
-# 3. Pick the most recent run for each cluster
+# 3. Pick the most recent run for each cluster (and of the global model, if one was trained)
 best_run_by_cluster = {}
+global_run = None
 for run in runs:
     run_name = run.data.tags.get("mlflow.runName", "")
+    if run_name == "global" and global_run is None:
+        global_run = run
     if not run_name.startswith("cluster_"):
         continue
     cluster_id = run_name.split("_", 1)[1]
     if cluster_id not in best_run_by_cluster:
         best_run_by_cluster[cluster_id] = run
 
-# 4. Register each cluster model version and transition stage
-for cluster_id, run in best_run_by_cluster.items():
+# (label, run, artifact path, registered model name) to register
+to_register = [
+    (f"Cluster {cluster_id}", run, ARTIFACT_PATH_FMT.format(cluster_id=cluster_id),
+     REGISTERED_MODEL_FMT.format(cluster_id=cluster_id))
+    for cluster_id, run in best_run_by_cluster.items()
+]
+if global_run is not None:
+    to_register.append(("Global", global_run, GLOBAL_ARTIFACT_PATH, GLOBAL_MODEL_NAME))
+
+# 4. Register each model version and transition stage
+for label, run, artifact_path, registered_model_name in to_register:
     run_id = run.info.run_id
-    artifact_path = ARTIFACT_PATH_FMT.format(cluster_id=cluster_id)
     model_uri = f"runs:/{run_id}/{artifact_path}"
-    registered_model_name = REGISTERED_MODEL_FMT.format(cluster_id=cluster_id)
 
     # Create the Registered Model if it doesn’t exist
     try:
@@ -62,6 +74,6 @@ for cluster_id, run in best_run_by_cluster.items():
     )
 
     print(
-        f"Cluster {cluster_id}: registered version {mv.version} "
+        f"{label}: registered version {mv.version} "
         f"of '{registered_model_name}' and moved to stage '{TARGET_STAGE}'"
     )
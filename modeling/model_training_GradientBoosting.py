@@ -1,20 +1,43 @@
 import os
-import sqlite3
+import sys
 import pandas as pd
-import numpy as np
 from sklearn.ensemble import HistGradientBoostingRegressor
-from sklearn.model_selection import GridSearchCV, cross_val_score
+from sklearn.model_selection import KFold, PredefinedSplit
 import mlflow
 import mlflow.sklearn
-import holidays
 import shap
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.data_access import connect, resolve_db_path
+from common.feature_store import FEATURE_COLUMNS, read_features, refresh_features
+from common.training import cluster_test_folds, parallel_search
+from common.trip_store import STORAGE_BACKEND
+
 # ─── Config ─────────────────────────────────────────────────────────────
 expected_table = "training_set_10_random_blue"
 output_csv_path = r"/modeling\cluster_metrics_summary_GradientBoosting.csv"
+global_csv_path = r"/modeling\cluster_metrics_global_vs_per_cluster.csv"
 shap_output_dir = r"/modeling\cluster_shap_outputs"
 country_code = "DE"  # e.g. 'DE' for Germany
+n_workers = os.cpu_count()  # one pool for all cluster x parameter x fold fits
+# 'halving' = successive halving (each round keeps the best 1/halving_factor, scored on factor x more folds),
+# 'grid' = the full gb_param_grid on the full folds
+search_method = "halving"
+halving_factor = 3
+# halving only: no further round starts after search_budget_s seconds or beyond search_max_fits fits
+# (search_max_fits must at least cover the first round, which scores every parameter set of every cluster)
+search_budget_s = None
+search_max_fits = None
+# shuffled so the first halving rounds (1-2 folds) are scored on hours from all days,
+# not only on the first days of the month (the feature rows are ordered by day)
+cv_folds = KFold(n_splits=5, shuffle=True, random_state=42)
+# 'per_cluster' = one model per cluster (TaxiDemandCluster_{id});
+# 'global' = one model over all clusters with cluster as a native categorical feature
+# (run 'global', registered as TaxiDemandGlobal), its per-cluster CV-MAE reported against
+# the per-cluster models on the same folds. Works for at most 255 clusters
+# (HistGradientBoosting's categorical cardinality limit, max_bins).
+model_scope = "per_cluster"
 
 gb_param_grid = {
     "learning_rate": [0.01, 0.1],
@@ -22,117 +45,126 @@ gb_param_grid = {
     "max_depth": [3, 5],
 }
 
-# ✅ Full Feature Set
-features = ['day', 'hour', 'special_day', 'weekend_hour_interaction']
-
-# ─── Locate .db file ────────────────────────────────────────────────────
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-db_path = None
-for root, dirs, files in os.walk(project_root):
-    for fn in files:
-        if "data_consolidated" in fn.lower() and fn.lower().endswith((".db", ".sqlite", ".sqlite3")):
-            candidate = os.path.join(root, fn)
-            with sqlite3.connect(candidate) as conn:
-                tables = pd.read_sql_query(
-                    "SELECT name FROM sqlite_master WHERE type='table';", conn
-                )['name'].tolist()
-            if expected_table in tables:
-                db_path = candidate
-                break
-    if db_path:
-        break
-
-if not db_path:
-    raise FileNotFoundError(f"No DB under {project_root!r} contains table '{expected_table}'")
-print(f"▶ Using database file: {db_path}")
-
-# ─── Load & preprocess ─────────────────────────────────────────────────
-with sqlite3.connect(db_path) as conn:
-    df = pd.read_sql_query(f"SELECT * FROM {expected_table}", conn)
-
-df['parsed_datetime'] = pd.to_datetime(df["Date/Time"])
-df['day'] = df['parsed_datetime'].dt.day
-df['hour'] = df['parsed_datetime'].dt.hour
-
-# ─── Special day encoding ──────────────────────────────────────────────
-def assign_special_day(date_series, country="DE"):
-    holiday_dates = holidays.country_holidays(country)
-    return np.where(
-        date_series.dt.date.isin(holiday_dates), 3,
-        np.where(date_series.dt.weekday == 5, 1,
-                 np.where(date_series.dt.weekday == 6, 2, 0))
-    )
-
-df['special_day'] = assign_special_day(df['parsed_datetime'], country=country_code)
-
-# ─── Create weekend-hour interaction ────────────────────────────────────
-df['is_weekend'] = df['special_day'].isin([1, 2]).astype(int)
-df['weekend_hour_interaction'] = df['is_weekend'] * df['hour']
-
-# ─── Grouping for Model Input ──────────────────────────────────────────
-df_counts = (
-    df.groupby(['cluster', 'day', 'hour', 'special_day', 'weekend_hour_interaction'])
-    .size()
-    .reset_index(name='count')
-)
-
-# ─── MLflow Setup ───────────────────────────────────────────────────────
-mlflow.set_experiment("Taxi_Demand_Per_Cluster")
-mlflow.sklearn.autolog(disable=True)
-os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
-os.makedirs(shap_output_dir, exist_ok=True)
-
-# ─── Train per-cluster model + SHAP ─────────────────────────────────────
-metrics_summary = []
-
-for cluster_id, grp in df_counts.groupby('cluster'):
-    X = grp[features]
-    y = grp['count']
-
-    with mlflow.start_run(run_name=f"cluster_{cluster_id}"):
-        grid = GridSearchCV(
-            HistGradientBoostingRegressor(loss="poisson"),
-            param_grid=gb_param_grid,
-            scoring='neg_mean_absolute_error',
-            cv=5,
-            n_jobs=-1
-        )
-        grid.fit(X, y)
-
-        best_model = grid.best_estimator_
-        best_params = grid.best_params_
-        mlflow.log_params(best_params)
-
-        cv_mae = -cross_val_score(
-            best_model, X, y,
-            scoring='neg_mean_absolute_error',
-            cv=5
-        ).mean()
-        mlflow.log_metric("cv_mae", cv_mae)
-
-        mlflow.sklearn.log_model(
-            sk_model=best_model,
-            artifact_path=f"model_cluster_{cluster_id}"
-        )
-
-        explainer = shap.Explainer(best_model, X)
-        shap_values = explainer(X)
-
-        plt.figure()
-        shap.summary_plot(shap_values, X, show=False)
-        plt.title(f"SHAP Summary - Cluster {cluster_id}")
-        plt.tight_layout()
-        plt.savefig(os.path.join(shap_output_dir, f"shap_cluster_{cluster_id}.png"))
-        plt.close()
-
-    metrics_summary.append({
-        "cluster_id": cluster_id,
-        **best_params,
-        "cv_mae": cv_mae
-    })
-
-# ─── Save Summary ───────────────────────────────────────────────────────
-metrics_df = pd.DataFrame(metrics_summary)
-metrics_df.to_csv(output_csv_path, index=False)
-print(f"▶ Saved metrics summary to: {output_csv_path}")
-print(f"▶ SHAP plots saved to: {shap_output_dir}")
+# ✅ Full Feature Set (as stored in the demand feature store)
+features = FEATURE_COLUMNS
+
+def main():
+    # ─── Locate .db file ────────────────────────────────────────────────────
+    db_path = resolve_db_path(expected_table)
+    print(f"▶ Using database file: {db_path}")
+
+    # ─── Load demand features ──────────────────────────────────────────────
+    # Counts per (cluster, day, hour, special_day) with the weekend-hour interaction, read
+    # from the hourly feature store (refreshed with any trips added since the last run).
+    # special_day codes: 0 = Weekday, 1 = Saturday, 2 = Sunday, 3 = Public Holiday.
+    with connect(db_path) as conn:
+        refresh_features(conn, expected_table, country=country_code)
+        df_counts = read_features(conn, expected_table, keys=['cluster'] + FEATURE_COLUMNS)
+    print(f"▶ Loaded {len(df_counts)} demand rows ({(df_counts['count'] == 0).sum()} with zero trips) "
+          f"from '{expected_table}' ({STORAGE_BACKEND})")
+
+    # the global model's categorical cluster feature is limited to max_bins (255) categories;
+    # fail here instead of after the per-cluster baseline search
+    n_clusters = df_counts['cluster'].nunique()
+    if model_scope == "global" and n_clusters > 255:
+        raise ValueError(f"model_scope='global' supports at most 255 clusters, found {n_clusters}; "
+                         f"use model_scope='per_cluster'")
+
+    # ─── MLflow Setup ───────────────────────────────────────────────────────
+    mlflow.set_experiment("Taxi_Demand_Per_Cluster")
+    mlflow.sklearn.autolog(disable=True)
+    os.makedirs(os.path.dirname(output_csv_path), exist_ok=True)
+    os.makedirs(shap_output_dir, exist_ok=True)
+
+    # ─── Train per-cluster model + SHAP ─────────────────────────────────────
+    metrics_summary = []
+
+    # Hyperparameter search of all clusters in one worker pool (cluster x parameter set x fold tasks);
+    # with model_scope = 'global' these per-cluster models are the baseline
+    frames = {cluster_id: (grp[features], grp['count']) for cluster_id, grp in df_counts.groupby('cluster')}
+    searches = parallel_search(frames, HistGradientBoostingRegressor(loss="poisson"), gb_param_grid,
+                               scoring='neg_mean_absolute_error', cv=cv_folds, workers=n_workers,
+                               method=search_method, factor=halving_factor,
+                               budget_s=search_budget_s, max_fits=search_max_fits)
+
+    for cluster_id, (X, y) in frames.items():
+        best_params = searches[cluster_id]["best_params"]
+        cv_mae = -searches[cluster_id]["best_score"]
+        metrics_summary.append({
+            "cluster_id": cluster_id,
+            **best_params,
+            "cv_mae": cv_mae
+        })
+        if model_scope != "per_cluster":
+            continue
+
+        with mlflow.start_run(run_name=f"cluster_{cluster_id}"):
+            best_model = searches[cluster_id]["best_estimator"]
+            mlflow.log_params(best_params)
+
+            # CV-MAE of the winner as recorded during the search (no second CV run)
+            mlflow.log_metric("cv_mae", cv_mae)
+
+            mlflow.sklearn.log_model(
+                sk_model=best_model,
+                artifact_path=f"model_cluster_{cluster_id}"
+            )
+
+            explainer = shap.Explainer(best_model, X)
+            shap_values = explainer(X)
+
+            plt.figure()
+            shap.summary_plot(shap_values, X, show=False)
+            plt.title(f"SHAP Summary - Cluster {cluster_id}")
+            plt.tight_layout()
+            plt.savefig(os.path.join(shap_output_dir, f"shap_cluster_{cluster_id}.png"))
+            plt.close()
+
+    # ─── Train one global model (model_scope = 'global') ────────────────────
+    if model_scope == "global":
+        # every cluster is split by its own KFold as in the per-cluster search, so the
+        # out-of-fold errors of both are measured on exactly the same rows
+        X_all = df_counts[['cluster'] + features]
+        y_all = df_counts['count']
+        test_fold = cluster_test_folds(df_counts['cluster'], cv=cv_folds)
+        search = parallel_search({"global": (X_all, y_all)},
+                                 HistGradientBoostingRegressor(loss="poisson", categorical_features=['cluster']),
+                                 gb_param_grid, scoring='neg_mean_absolute_error', cv=PredefinedSplit(test_fold),
+                                 workers=n_workers, method=search_method, factor=halving_factor,
+                                 budget_s=search_budget_s, max_fits=search_max_fits)["global"]
+
+        # per-cluster CV-MAE of the global model: mean over the cluster's folds, like the per-cluster cv_mae
+        abs_error = (y_all - search["oof_predictions"]).abs()
+        global_mae = abs_error.groupby([df_counts['cluster'], test_fold]).mean().groupby(level=0).mean()
+        comparison = (pd.DataFrame(metrics_summary)[["cluster_id", "cv_mae"]]
+                      .rename(columns={"cv_mae": "per_cluster_cv_mae"}))
+        comparison["global_cv_mae"] = comparison["cluster_id"].map(global_mae)
+        comparison["delta"] = comparison["global_cv_mae"] - comparison["per_cluster_cv_mae"]
+
+        with mlflow.start_run(run_name="global"):
+            mlflow.log_params(search["best_params"])
+            mlflow.log_metric("cv_mae", -search["best_score"])
+            for row in comparison.itertuples():
+                mlflow.log_metric(f"cv_mae_cluster_{row.cluster_id}", row.global_cv_mae)
+            mlflow.sklearn.log_model(
+                sk_model=search["best_estimator"],
+                artifact_path="model_global"
+            )
+
+        comparison.to_csv(global_csv_path, index=False)
+        print("\n===== GLOBAL vs PER-CLUSTER CV-MAE =====")
+        print(comparison.round(4).to_string(index=False))
+        print(f"▶ Global model: CV-MAE {-search['best_score']:.4f} ({search['best_params']}); "
+              f"mean per-cluster baseline {comparison['per_cluster_cv_mae'].mean():.4f}")
+        print(f"▶ Saved comparison to: {global_csv_path}")
+
+    # ─── Save Summary ───────────────────────────────────────────────────────
+    metrics_df = pd.DataFrame(metrics_summary)
+    metrics_df.to_csv(output_csv_path, index=False)
+    print(f"▶ Saved metrics summary to: {output_csv_path}")
+    if model_scope == "per_cluster":
+        print(f"▶ SHAP plots saved to: {shap_output_dir}")
+
+
+if __name__ == "__main__":
+    main()
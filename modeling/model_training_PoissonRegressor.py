@@ -1,12 +1,16 @@
 import os
-import sqlite3
+import sys
 import pandas as pd
-import numpy as np
 from sklearn.linear_model import PoissonRegressor
-from sklearn.model_selection import GridSearchCV, cross_val_score
+from sklearn.model_selection import KFold
 import mlflow
 import mlflow.sklearn
-import holidays
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from common.data_access import connect, resolve_db_path
+from common.feature_store import read_features, refresh_features
+from common.training import parallel_search
+from common.trip_store import STORAGE_BACKEND
 
 # ─── Config ─────────────────────────────────────────────────────────────
 expected_table = "training_set_10_random_blue"
@@ -16,125 +20,86 @@ param_grid = {
 }
 output_csv_path = r"/modeling\cluster_metrics_summary_PoissonRegressor.csv"
 country_code = "DE"  # Germany for public holidays
-
-# ─── Find the database ───────────────────────────────────────────────────
-project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-db_path = None
-
-for root, dirs, files in os.walk(project_root):
-    for fn in files:
-        if "data_consolidated" in fn.lower() and fn.lower().endswith((".db", ".sqlite", ".sqlite3")):
-            candidate = os.path.join(root, fn)
-            with sqlite3.connect(candidate) as conn:
-                existing_tables = pd.read_sql_query(
-                    "SELECT name FROM sqlite_master WHERE type='table';", conn
-                )['name'].tolist()
-            if expected_table in existing_tables:
-                db_path = candidate
-                break
-    if db_path:
-        break
-
-if not db_path:
-    raise FileNotFoundError(
-        f"No database file under {project_root!r} contains the table '{expected_table}'."
-    )
-
-print(f"▶ Using database file: {db_path}")
-
-# ─── Load data ──────────────────────────────────────────────────────────
-with sqlite3.connect(db_path) as conn:
-    df = pd.read_sql_query(f"SELECT * FROM {expected_table}", conn)
-
-# ─── Feature engineering ────────────────────────────────────────────────
-df['parsed_datetime'] = pd.to_datetime(df["Date/Time"])
-df['day'] = df['parsed_datetime'].dt.day
-df['hour'] = df['parsed_datetime'].dt.hour
-
-def assign_special_day(date_series, country="DE"):
-    holiday_dates = holidays.country_holidays(country)
-    special_days = np.where(
-        date_series.dt.date.isin(holiday_dates),
-        3,  # Public Holiday
-        np.where(
-            date_series.dt.weekday == 5,  # Saturday
-            1,
-            np.where(
-                date_series.dt.weekday == 6,  # Sunday
-                2,
-                0  # Weekday (Mon-Fri)
+n_workers = os.cpu_count()  # one pool for all cluster x parameter x fold fits
+# 'halving' = successive halving (each round keeps the best 1/halving_factor, scored on factor x more folds),
+# 'grid' = every parameter set on the full folds
+search_method = "halving"
+halving_factor = 3
+# halving only: no further round starts after search_budget_s seconds or beyond search_max_fits fits
+# (search_max_fits must at least cover the first round, which scores every parameter set of every cluster)
+search_budget_s = None
+search_max_fits = None
+# shuffled so the first halving rounds (1-2 folds) are scored on hours from all days,
+# not only on the first days of the month (the feature rows are ordered by day)
+cv_folds = KFold(n_splits=5, shuffle=True, random_state=42)
+
+def main():
+    # ─── Find the database ───────────────────────────────────────────────────
+    db_path = resolve_db_path(expected_table)
+    print(f"▶ Using database file: {db_path}")
+
+    # ─── Load data ──────────────────────────────────────────────────────────
+    # Demand counts per (cluster, day, hour, special_day) from the hourly feature store
+    # (refreshed with any trips added since the last run; zero-demand hours included);
+    # special_day: 0 = Weekday (Mon-Fri), 1 = Saturday, 2 = Sunday, 3 = Public Holiday
+    with connect(db_path) as conn:
+        refresh_features(conn, expected_table, country=country_code)
+        df_counts = read_features(conn, expected_table, keys=['cluster', 'day', 'hour', 'special_day'])
+    print(f"▶ Loaded {len(df_counts)} demand rows ({(df_counts['count'] == 0).sum()} with zero trips) "
+          f"from '{expected_table}' ({STORAGE_BACKEND})")
+
+    # ─── MLflow setup ───────────────────────────────────────────────────────
+    mlflow.set_experiment("Taxi_Demand_Per_Cluster")
+    mlflow.sklearn.autolog(disable=True)
+
+    # ─── Train one PoissonRegressor per cluster ─────────────────────────────
+    metrics_summary = []
+    models = {}
+
+    # Hyperparameter search for all clusters at once (cluster x parameter set x fold tasks)
+    frames = {
+        cluster_id: (grp[['day', 'hour', 'special_day']], grp['count'])
+        for cluster_id, grp in df_counts.groupby('cluster')
+    }
+    searches = parallel_search(frames, PoissonRegressor(), param_grid,
+                               scoring='neg_mean_absolute_error', cv=cv_folds, workers=n_workers,
+                               method=search_method, factor=halving_factor,
+                               budget_s=search_budget_s, max_fits=search_max_fits)
+
+    for cluster_id, (X, y) in frames.items():
+        with mlflow.start_run(run_name=f"cluster_{cluster_id}"):
+            # Log best parameters; the search already refitted them on all rows of the cluster
+            best_params = searches[cluster_id]["best_params"]
+            mlflow.log_params(best_params)
+            model = searches[cluster_id]["best_estimator"]
+
+            # Log the CV-MAE recorded for the winner during the search (no second CV run)
+            cv_mae = -searches[cluster_id]["best_score"]
+            mlflow.log_metric("cv_mae", cv_mae)
+
+            # Save the tuned model as an MLflow artifact
+            mlflow.sklearn.log_model(
+                sk_model=model,
+                artifact_path=f"model_cluster_{cluster_id}"
             )
-        )
-    )
-    return special_days
-
-df['special_day'] = assign_special_day(df['parsed_datetime'], country=country_code)
-
-df_counts = (
-    df.groupby(['cluster', 'day', 'hour', 'special_day'])
-      .size()
-      .reset_index(name='count')
-)
-
-# ─── MLflow setup ───────────────────────────────────────────────────────
-mlflow.set_experiment("Taxi_Demand_Per_Cluster")
-mlflow.sklearn.autolog(disable=True)
-
-# ─── Train one PoissonRegressor per cluster ─────────────────────────────
-metrics_summary = []
-models = {}
-
-for cluster_id, grp in df_counts.groupby('cluster'):
-    X = grp[['day', 'hour', 'special_day']]
-    y = grp['count']
-
-    with mlflow.start_run(run_name=f"cluster_{cluster_id}"):
-        # Hyperparameter search
-        grid = GridSearchCV(
-            estimator=PoissonRegressor(),
-            param_grid=param_grid,
-            scoring='neg_mean_absolute_error',
-            cv=5,
-            n_jobs=-1
-        )
-        grid.fit(X, y)
-
-        # Log best parameters
-        best_params = grid.best_params_
-        mlflow.log_params(best_params)
-
-        # Train final model with best parameters
-        model = PoissonRegressor(**best_params)
-        model.fit(X, y)
-
-        # Compute and log CV-MAE
-        cv_mae = -cross_val_score(
-            model, X, y,
-            scoring='neg_mean_absolute_error',
-            cv=5
-        ).mean()
-        mlflow.log_metric("cv_mae", cv_mae)
 
-        # Save the tuned model as an MLflow artifact
-        mlflow.sklearn.log_model(
-            sk_model=model,
-            artifact_path=f"model_cluster_{cluster_id}"
-        )
+        # Store metrics for CSV
+        metrics_summary.append({
+            "cluster_id": cluster_id,
+            "alpha":      best_params["alpha"],
+            "max_iter":   best_params["max_iter"],
+            "cv_mae":     cv_mae
+        })
+        models[cluster_id] = model
 
-    # Store metrics for CSV
-    metrics_summary.append({
-        "cluster_id": cluster_id,
-        "alpha":      best_params["alpha"],
-        "max_iter":   best_params["max_iter"],
-        "cv_mae":     cv_mae
-    })
-    models[cluster_id] = model
+    # ─── Write summary CSV ──────────────────────────────────────────────────
+    out_dir = os.path.dirname(output_csv_path)
+    os.makedirs(out_dir, exist_ok=True)
 
-# ─── Write summary CSV ──────────────────────────────────────────────────
-out_dir = os.path.dirname(output_csv_path)
-os.makedirs(out_dir, exist_ok=True)
+    metrics_df = pd.DataFrame(metrics_summary)
+    metrics_df.to_csv(output_csv_path, index=False)
+    print(f"▶ Saved cluster metrics summary to: {output_csv_path}")
 
-metrics_df = pd.DataFrame(metrics_summary)
-metrics_df.to_csv(output_csv_path, index=False)
-print(f"▶ Saved cluster metrics summary to: {output_csv_path}")
 
+if __name__ == "__main__":
+    main()